@@ -23,6 +23,10 @@ from app.models.llm_config import (
     TestProviderRequest,
     TestProviderResponse,
 )
+from app.services.answer_cache import get_answer_cache_metrics
+from app.services.chat import get_web_search_metrics
+from app.services.latency import get_latency_analytics
+from app.services.reindex import get_reindex_service
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 settings = get_settings()
@@ -288,6 +292,45 @@ async def get_top_users(
     }
 
 
+@router.get("/analytics/web-search")
+async def get_web_search_analytics(
+    _: str = Depends(verify_admin_key),
+):
+    return await get_web_search_metrics()
+
+
+@router.get("/analytics/latency")
+async def get_latency_breakdown(
+    days: int = Query(7, ge=1, le=90),
+    db: AsyncSession = Depends(get_db),
+    _: str = Depends(verify_admin_key),
+):
+    return await get_latency_analytics(db, days)
+
+
+@router.get("/analytics/answer-cache")
+async def get_answer_cache_analytics(
+    _: str = Depends(verify_admin_key),
+):
+    return await get_answer_cache_metrics()
+
+
+@router.get("/reindex")
+async def get_reindex_status(
+    _: str = Depends(verify_admin_key),
+):
+    state = await get_reindex_service().get_state()
+    return state or {"status": "idle"}
+
+
+@router.post("/reindex")
+async def start_reindex(
+    _: str = Depends(verify_admin_key),
+):
+    # Starting again after a crash or failure resumes from the last checkpoint.
+    return await get_reindex_service().start()
+
+
 def _provider_to_response(provider: LLMProvider) -> LLMProviderResponse:
     return LLMProviderResponse(
         id=provider.id,
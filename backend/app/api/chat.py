@@ -1,14 +1,17 @@
+import asyncio
 import logging
+from contextlib import aclosing, suppress
 from uuid import UUID
 from typing import Optional
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Query
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 
-from app.db import get_db
+from app.db import get_db, get_db_session
 from app.db.redis import get_redis, RedisCache
-from app.db.postgres import Conversation, Message
+from app.db.postgres import Conversation, Message, MessageStatus
 from app.config import get_settings
 from app.models.chat import (
     ChatRequest,
@@ -23,7 +26,16 @@ from app.models.chat import (
 )
 from app.models.llm_config import AvailableModelsResponse
 from app.services.chat import get_chat_service
+from app.services.connection import (
+    CLOSE_IDLE,
+    MSGPACK_SUBPROTOCOL,
+    ChatConnection,
+    ConnectionClosed,
+    token_frame,
+)
+from app.services.latency import TurnTimer
 from app.services.rate_limiter import RateLimiter
+from app.services.sse import SSEStream, get_sse_streams, parse_event_id
 from app.services.llm import LLMException, get_llm_service
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
@@ -37,15 +49,27 @@ async def get_rate_limiter() -> RateLimiter:
     return RateLimiter(cache, settings.RATE_LIMIT_SALT)
 
 
+async def _cancel_turn(db: AsyncSession, turn: asyncio.Task) -> None:
+    turn.cancel()
+    await asyncio.gather(turn, return_exceptions=True)
+    # The turn may have been cut off mid-query.
+    await db.rollback()
+
+
 @router.websocket("/ws")
 async def websocket_chat(
     websocket: WebSocket,
     session_id: str = Query(...),
     fingerprint: str = Query(...),
     model_id: Optional[str] = Query(None),
+    timings: bool = Query(False),
+    coalesce: bool = Query(False),
     db: AsyncSession = Depends(get_db),
 ):
-    await websocket.accept()
+    subprotocol = None
+    if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        subprotocol = MSGPACK_SUBPROTOCOL
+    await websocket.accept(subprotocol=subprotocol)
 
     redis_client = await get_redis()
     cache = RedisCache(redis_client)
@@ -55,9 +79,89 @@ async def websocket_chat(
     user_id = await rate_limiter.resolve_user_id(fingerprint, websocket)
     parsed_model_id = UUID(model_id) if model_id else None
 
+    # This handler is the reader: it keeps receiving while a turn streams, so
+    # cancel, ping and model changes are handled mid-stream. Turns run as
+    # tasks and hand their frames to the connection's writer.
+    connection = ChatConnection(websocket, coalesce=coalesce, subprotocol=subprotocol)
+    connection.start()
+    turn: Optional[asyncio.Task] = None
+
+    def is_idle() -> bool:
+        return turn is None or turn.done()
+
+    async def stream_turn(content: str, turn_model_id: Optional[UUID]) -> None:
+        try:
+            source_info_sent = False
+            timer = TurnTimer()
+            stream = chat_service.chat_stream(
+                db=db,
+                message=content,
+                session_id=session_id,
+                user_id=user_id,
+                model_id=turn_model_id,
+                timer=timer,
+            )
+            async with aclosing(stream):
+                async for chunk, context_result in stream:
+                    if chunk:
+                        source_info = None
+                        if context_result and not source_info_sent:
+                            source_info = SourceInfo(
+                                source_type=ContextSourceType(context_result.source.value),
+                                sources=context_result.sources
+                            ).model_dump()
+                            source_info_sent = True
+                        await connection.send(token_frame(chunk, source_info))
+
+            await connection.send(
+                WebSocketMessage(
+                    type="complete",
+                    timings=timer.as_dict() if timings else None,
+                ).model_dump()
+            )
+
+        except ConnectionClosed:
+            pass
+
+        except LLMException as e:
+            logger.warning(
+                f"LLM error in chat stream",
+                extra={
+                    "session_id": session_id,
+                    "user_id": user_id,
+                    "error_type": e.error.error_type,
+                    "provider": e.error.provider,
+                    "retry_after": e.error.retry_after,
+                }
+            )
+            error_response = {
+                "type": "llm_error",
+                "message": e.error.user_message,
+                "error_type": e.error.error_type,
+                "retry_after": e.error.retry_after,
+                "is_retryable": e.error.is_retryable,
+            }
+            with suppress(ConnectionClosed):
+                await connection.send(error_response)
+
+        except Exception as e:
+            logger.error(
+                f"Unexpected error in chat stream",
+                extra={"session_id": session_id, "user_id": user_id, "error": str(e)[:200]}
+            )
+            with suppress(ConnectionClosed):
+                await connection.send(
+                    WebSocketMessage(type="error", message="An unexpected error occurred. Please try again.").model_dump()
+                )
+
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await connection.receive(is_idle)
+            if data is None:
+                logger.info(f"Closing idle WebSocket for session {session_id}")
+                await connection.close(CLOSE_IDLE, "Idle timeout")
+                break
+
             msg_type = data.get("type")
             content = data.get("content", "")
             msg_model_id = data.get("model_id")
@@ -68,15 +172,36 @@ async def websocket_chat(
                 except ValueError:
                     pass
 
+            if msg_type == "ping":
+                await connection.send(WebSocketMessage(type="pong").model_dump())
+                continue
+
+            if msg_type == "pong":
+                continue
+
+            if msg_type == "cancel":
+                if not is_idle():
+                    await _cancel_turn(db, turn)
+                    await connection.send(WebSocketMessage(type="cancelled").model_dump())
+                continue
+
             if msg_type != "message" or not content:
-                await websocket.send_json(
-                    WebSocketMessage(type="error", message="Invalid message format").model_dump()
+                # A model change on its own needs no reply.
+                if not msg_model_id:
+                    await connection.send(
+                        WebSocketMessage(type="error", message="Invalid message format").model_dump()
+                    )
+                continue
+
+            if not is_idle():
+                await connection.send(
+                    WebSocketMessage(type="error", message="A response is already in progress").model_dump()
                 )
                 continue
 
             rate_check = await rate_limiter.check_rate_limit(fingerprint, websocket)
             if not rate_check["allowed"]:
-                await websocket.send_json(
+                await connection.send(
                     WebSocketMessage(
                         type="rate_limited",
                         message=f"Rate limit exceeded. Retry after {rate_check.get('retry_after', 60)} seconds",
@@ -88,61 +213,17 @@ async def websocket_chat(
 
             await rate_limiter.increment(fingerprint, websocket)
 
-            try:
-                source_info_sent = False
-                async for chunk, context_result in chat_service.chat_stream(
-                    db=db,
-                    message=content,
-                    session_id=session_id,
-                    user_id=user_id,
-                    model_id=parsed_model_id,
-                ):
-                    if chunk:
-                        msg = WebSocketMessage(type="token", content=chunk)
-                        if context_result and not source_info_sent:
-                            msg.source_info = SourceInfo(
-                                source_type=ContextSourceType(context_result.source.value),
-                                sources=context_result.sources
-                            )
-                            source_info_sent = True
-                        await websocket.send_json(msg.model_dump())
-
-                await websocket.send_json(
-                    WebSocketMessage(type="complete").model_dump()
-                )
-
-            except LLMException as e:
-                logger.warning(
-                    f"LLM error in chat stream",
-                    extra={
-                        "session_id": session_id,
-                        "user_id": user_id,
-                        "error_type": e.error.error_type,
-                        "provider": e.error.provider,
-                        "retry_after": e.error.retry_after,
-                    }
-                )
-                error_response = {
-                    "type": "llm_error",
-                    "message": e.error.user_message,
-                    "error_type": e.error.error_type,
-                    "retry_after": e.error.retry_after,
-                    "is_retryable": e.error.is_retryable,
-                }
-                await websocket.send_json(error_response)
-
-            except Exception as e:
-                logger.error(
-                    f"Unexpected error in chat stream",
-                    extra={"session_id": session_id, "user_id": user_id, "error": str(e)[:200]}
-                )
-                await websocket.send_json(
-                    WebSocketMessage(type="error", message="An unexpected error occurred. Please try again.").model_dump()
-                )
+            turn = asyncio.create_task(stream_turn(content, parsed_model_id))
 
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, ConnectionClosed):
         pass
 
+    finally:
+        # A disconnect stops the generation instead of letting it run on.
+        if not is_idle():
+            await _cancel_turn(db, turn)
+        await connection.close()
+
 
 @router.post("", response_model=ChatResponse)
 async def chat(
@@ -189,6 +270,119 @@ async def chat(
     )
 
 
+async def _produce_sse(
+    stream: SSEStream,
+    chat_request: ChatRequest,
+    user_id: str,
+    timings: bool,
+) -> None:
+    # Runs as the stream's own task with its own session: the request's
+    # session is gone once the response starts, and the turn may outlive a
+    # dropped connection for the resume grace period.
+    timer = TurnTimer()
+    source_info_sent = False
+    try:
+        async with get_db_session() as db:
+            turn = get_chat_service().chat_stream(
+                db=db,
+                message=chat_request.message,
+                session_id=chat_request.session_id,
+                user_id=user_id,
+                model_id=chat_request.model_id,
+                timer=timer,
+            )
+            async with aclosing(turn):
+                async for chunk, context_result in turn:
+                    if chunk:
+                        data = {"content": chunk}
+                        if context_result and not source_info_sent:
+                            data["source_info"] = SourceInfo(
+                                source_type=ContextSourceType(context_result.source.value),
+                                sources=context_result.sources
+                            ).model_dump()
+                            source_info_sent = True
+                        stream.publish("token", data)
+
+        stream.publish("complete", {"timings": timer.as_dict() if timings else None})
+
+    except LLMException as e:
+        logger.warning(
+            f"LLM error in SSE chat stream",
+            extra={
+                "session_id": chat_request.session_id,
+                "user_id": user_id,
+                "error_type": e.error.error_type,
+                "provider": e.error.provider,
+                "retry_after": e.error.retry_after,
+            }
+        )
+        stream.publish("llm_error", {
+            "message": e.error.user_message,
+            "error_type": e.error.error_type,
+            "retry_after": e.error.retry_after,
+            "is_retryable": e.error.is_retryable,
+        })
+
+    except Exception as e:
+        logger.error(
+            f"Unexpected error in SSE chat stream",
+            extra={"session_id": chat_request.session_id, "user_id": user_id, "error": str(e)[:200]}
+        )
+        stream.publish("error", {"message": "An unexpected error occurred. Please try again."})
+
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/stream")
+async def chat_sse(
+    request: Request,
+    chat_request: ChatRequest,
+    timings: bool = Query(False),
+    last_event_id: Optional[str] = Header(None),
+):
+    streams = get_sse_streams()
+    rate_limiter = await get_rate_limiter()
+
+    # A reconnect picks up the same turn after the last event it saw rather
+    # than starting, and paying for, a new one.
+    resume = parse_event_id(last_event_id)
+    if resume:
+        stream_id, seq = resume
+        user_id = await rate_limiter.resolve_user_id(chat_request.fingerprint, request)
+        stream = streams.get(stream_id, chat_request.session_id, user_id)
+        if stream is None:
+            raise HTTPException(status_code=404, detail="Stream not found or expired")
+        return _sse_response(stream.listen(after=seq))
+
+    rate_check = await rate_limiter.check_rate_limit(chat_request.fingerprint, request)
+    if not rate_check["allowed"]:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "Rate limit exceeded",
+                "retry_after": rate_check.get("retry_after", 60),
+                "limits": rate_check["limits"],
+            },
+            headers={"Retry-After": str(rate_check.get("retry_after", 60))},
+        )
+
+    user_id = rate_check["user_id"]
+    await rate_limiter.increment(chat_request.fingerprint, request)
+
+    stream = streams.open(
+        chat_request.session_id,
+        user_id,
+        lambda s: _produce_sse(s, chat_request, user_id, timings),
+    )
+    return _sse_response(stream.listen())
+
+
 @router.get("/history/{session_id}", response_model=ChatHistoryResponse)
 async def get_chat_history(
     session_id: str,
@@ -211,11 +405,12 @@ async def get_chat_history(
         return ChatHistoryResponse(session_id=session_id, messages=[])
 
     result = await db.execute(
-        select(Message)
+        select(Message, MessageStatus.status)
+        .outerjoin(MessageStatus, MessageStatus.message_id == Message.id)
         .where(Message.conversation_id == conversation.id)
         .order_by(Message.created_at.asc())
     )
-    messages = result.scalars().all()
+    messages = result.all()
 
     return ChatHistoryResponse(
         session_id=session_id,
@@ -225,8 +420,9 @@ async def get_chat_history(
                 role=msg.role,
                 content=msg.content,
                 created_at=msg.created_at,
+                status=status or "completed",
             )
-            for msg in messages
+            for msg, status in messages
         ],
     )
 
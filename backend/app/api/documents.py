@@ -1,12 +1,14 @@
+import asyncio
+import logging
 import uuid
 from datetime import datetime
 from typing import Optional
 
 from pathlib import Path
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Header
-from fastapi.responses import FileResponse
-from sqlalchemy import select
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Header, BackgroundTasks, Query, Request
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import get_settings
@@ -16,14 +18,36 @@ from app.models.document import (
     DocumentResponse,
     DocumentListResponse,
     DocumentUploadResponse,
+    DocumentReplaceResponse,
+    BulkUploadJobResponse,
     DocumentStatus,
     DocumentVisibility,
 )
-from app.services.document import get_document_processor
+from app.services.document import (
+    LEGACY_CHUNKING,
+    ChunkingPolicy,
+    diff_chunks,
+    get_document_processor,
+    get_file_extension,
+    remove_file,
+)
+from app.services.answer_cache import bump_corpus_version
+from app.services.dedup import MinHash, NearDuplicateError, find_near_duplicate, save_signature
+from app.services.ingestion import (
+    get_chunking_policy,
+    get_ingestion_pipeline,
+    insert_chunks,
+    resolve_chunking,
+    save_chunking_policy,
+)
 from app.services.qdrant import get_qdrant_service
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_CONTROL_REVALIDATE = "public, max-age=0, must-revalidate"
 
 
 def verify_admin_key(x_admin_key: Optional[str] = Header(None)) -> str:
@@ -32,6 +56,26 @@ def verify_admin_key(x_admin_key: Optional[str] = Header(None)) -> str:
     return x_admin_key
 
 
+def get_chunking_form(
+    chunk_strategy: Optional[str] = Form(None),
+    chunk_size: Optional[int] = Form(None),
+    chunk_overlap: Optional[int] = Form(None),
+) -> ChunkingPolicy:
+    try:
+        return ChunkingPolicy.from_settings(chunk_strategy, chunk_size, chunk_overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag
+        for tag in if_none_match.split(",")
+    )
+
+
 @router.get("", response_model=DocumentListResponse)
 async def list_documents(db: AsyncSession = Depends(get_db)):
     query = (
@@ -73,16 +117,15 @@ async def get_document(
 @router.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
+    policy: ChunkingPolicy = Depends(get_chunking_form),
     db: AsyncSession = Depends(get_db),
     _: str = Depends(verify_admin_key),
 ):
     processor = get_document_processor()
-    qdrant = get_qdrant_service()
-
-    content = await file.read()
+    pipeline = get_ingestion_pipeline()
 
     try:
-        file_info = await processor.process_upload(file.filename, content)
+        file_info = await processor.process_upload(file.filename, file, size_hint=file.size)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -90,13 +133,14 @@ async def upload_document(
         select(Document).where(Document.file_hash == file_info["file_hash"])
     )
     if existing.scalar_one_or_none():
+        processor.discard_upload(file_info["temp_path"])
         raise HTTPException(status_code=409, detail="Document already exists")
 
     doc_id = uuid.uuid4()
     storage_path = await processor.save_document(
         str(doc_id),
         file_info["file_type"],
-        content,
+        file_info["temp_path"],
     )
 
     document = Document(
@@ -112,47 +156,30 @@ async def upload_document(
         owner_id=None,
     )
     db.add(document)
+    save_chunking_policy(db, doc_id, policy)
     await db.commit()
 
     try:
-        chunks = processor.extract_and_chunk(
-            content,
-            file_info["file_type"],
-            chunk_size=500,
-            chunk_overlap=50,
-        )
-
-        vector_ids = await qdrant.add_chunks(
-            document_id=str(doc_id),
-            chunks=chunks,
-            visibility="global",
-        )
+        ingested = await pipeline.ingest(db, document, policy)
 
-        for chunk, vector_id in zip(chunks, vector_ids):
-            db_chunk = DocumentChunk(
-                document_id=doc_id,
-                chunk_index=chunk["chunk_index"],
-                content=chunk["content"],
-                content_hash=chunk["content_hash"],
-                vector_id=vector_id,
-                start_char=chunk.get("start_char"),
-                end_char=chunk.get("end_char"),
-                page_number=chunk.get("page_number"),
+        message = f"Document processed with {ingested.chunks_count} chunks"
+        if ingested.duplicate_of:
+            message += (
+                f"; near-duplicate of document {ingested.duplicate_of} "
+                f"(similarity {ingested.similarity:.2f})"
             )
-            db.add(db_chunk)
-
-        document.status = "ready"
-        document.chunks_count = len(chunks)
-        document.processed_at = datetime.utcnow()
-        await db.commit()
 
         return DocumentUploadResponse(
             id=doc_id,
             filename=file.filename,
             status=DocumentStatus.READY,
-            message=f"Document processed with {len(chunks)} chunks",
+            message=message,
         )
 
+    except NearDuplicateError as e:
+        await pipeline.discard(db, document)
+        raise HTTPException(status_code=409, detail=str(e))
+
     except Exception as e:
         document.status = "failed"
         document.error_message = str(e)
@@ -160,9 +187,280 @@ async def upload_document(
         raise HTTPException(status_code=500, detail=f"Processing failed: {e}")
 
 
+@router.post("/bulk-upload", response_model=BulkUploadJobResponse)
+async def bulk_upload_documents(
+    background_tasks: BackgroundTasks,
+    files: list[UploadFile] = File(...),
+    policy: ChunkingPolicy = Depends(get_chunking_form),
+    db: AsyncSession = Depends(get_db),
+    _: str = Depends(verify_admin_key),
+):
+    processor = get_document_processor()
+    pipeline = get_ingestion_pipeline()
+    max_files = settings.BULK_UPLOAD_MAX_FILES
+
+    entries = []
+    try:
+        for file in files:
+            remaining = max_files - len(entries)
+            try:
+                if get_file_extension(file.filename) == "zip":
+                    entries.extend(await processor.process_archive(file, max_entries=remaining))
+                elif remaining <= 0:
+                    entries.append({"filename": file.filename, "error": "Too many files in upload"})
+                else:
+                    entries.append(
+                        await processor.process_upload(file.filename, file, size_hint=file.size)
+                    )
+            except ValueError as e:
+                entries.append({"filename": file.filename, "error": str(e)})
+
+        hashes = {e["file_hash"] for e in entries if "file_hash" in e}
+        existing_hashes = set()
+        if hashes:
+            existing = await db.execute(
+                select(Document.file_hash).where(
+                    Document.file_hash.in_(hashes),
+                    Document.deleted_at.is_(None),
+                )
+            )
+            existing_hashes = set(existing.scalars().all())
+
+        results = []
+        items = []
+        for entry in entries:
+            if "error" in entry:
+                results.append({"filename": entry["filename"], "status": "rejected", "message": entry["error"]})
+                continue
+
+            if entry["file_hash"] in existing_hashes:
+                processor.discard_upload(entry["temp_path"])
+                results.append({"filename": entry["filename"], "status": "duplicate", "message": "Document already exists"})
+                continue
+            existing_hashes.add(entry["file_hash"])
+
+            doc_id = uuid.uuid4()
+            storage_path = await processor.save_document(
+                str(doc_id),
+                entry["file_type"],
+                entry["temp_path"],
+            )
+            db.add(Document(
+                id=doc_id,
+                filename=entry["filename"],
+                original_filename=entry["filename"],
+                file_type=entry["file_type"],
+                file_size_bytes=entry["file_size_bytes"],
+                file_hash=entry["file_hash"],
+                storage_path=storage_path,
+                status="pending",
+                visibility="global",
+                owner_id=None,
+            ))
+            save_chunking_policy(db, doc_id, policy)
+            items.append({
+                "result_index": len(results),
+                "document_id": doc_id,
+                "file_type": entry["file_type"],
+                "storage_path": storage_path,
+            })
+            results.append({"filename": entry["filename"], "status": "queued", "document_id": str(doc_id)})
+
+        await db.commit()
+    finally:
+        # Drops temp files for entries that never made it into storage.
+        processor.discard_entries(entries)
+
+    job = pipeline.new_job(results)
+    if not items:
+        job["status"] = "completed"
+    await pipeline.save_job(job)
+    if items:
+        background_tasks.add_task(pipeline.run_job, job, items)
+
+    return BulkUploadJobResponse(**job)
+
+
+@router.get("/jobs/{job_id}", response_model=BulkUploadJobResponse)
+async def get_bulk_upload_job(
+    job_id: str,
+    _: str = Depends(verify_admin_key),
+):
+    job = await get_ingestion_pipeline().get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return BulkUploadJobResponse(**job)
+
+
+@router.put("/{document_id}", response_model=DocumentReplaceResponse)
+async def replace_document(
+    document_id: uuid.UUID,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    _: str = Depends(verify_admin_key),
+):
+    query = select(Document).where(
+        Document.id == document_id,
+        Document.deleted_at.is_(None),
+    )
+    result = await db.execute(query)
+    document = result.scalar_one_or_none()
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    processor = get_document_processor()
+    qdrant = get_qdrant_service()
+
+    try:
+        file_info = await processor.process_upload(file.filename, file, size_hint=file.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    temp_path = file_info["temp_path"]
+
+    if file_info["file_hash"] == document.file_hash:
+        processor.discard_upload(temp_path)
+        return DocumentReplaceResponse(
+            id=document.id,
+            filename=document.filename,
+            status=DocumentStatus(document.status),
+            message="Document unchanged",
+            chunks_unchanged=document.chunks_count,
+        )
+
+    existing = await db.execute(
+        select(Document).where(
+            Document.file_hash == file_info["file_hash"],
+            Document.id != document_id,
+        )
+    )
+    if existing.scalar_one_or_none():
+        processor.discard_upload(temp_path)
+        raise HTTPException(status_code=409, detail="Document already exists")
+
+    old_storage_path = document.storage_path
+    new_vector_ids = []
+    storage_path = None
+    stash_path = None
+    try:
+        # Re-chunk the way the document was first split so unchanged text
+        # produces identical chunks.
+        policy = await get_chunking_policy(db, document_id, LEGACY_CHUNKING)
+        policy, length_function = await resolve_chunking(policy)
+        chunks = await asyncio.to_thread(
+            processor.extract_and_chunk,
+            temp_path,
+            file_info["file_type"],
+            policy.chunk_size,
+            policy.chunk_overlap,
+            length_function,
+        )
+
+        result = await db.execute(
+            select(DocumentChunk).where(DocumentChunk.document_id == document_id)
+        )
+        kept, added, removed = diff_chunks(result.scalars().all(), chunks)
+
+        owner_id = str(document.owner_id) if document.owner_id else None
+        new_vector_ids = await qdrant.add_chunks(
+            document_id=str(document_id),
+            chunks=added,
+            visibility=document.visibility,
+            owner_id=owner_id,
+        )
+
+        if removed:
+            await db.execute(
+                delete(DocumentChunk).where(
+                    DocumentChunk.id.in_([row.id for row in removed])
+                )
+            )
+
+        payload_updates = []
+        for db_chunk, chunk in kept:
+            position = {
+                "chunk_index": chunk["chunk_index"],
+                "start_char": chunk.get("start_char"),
+                "end_char": chunk.get("end_char"),
+                "page_number": chunk.get("page_number"),
+            }
+            if any(getattr(db_chunk, key) != value for key, value in position.items()):
+                for key, value in position.items():
+                    setattr(db_chunk, key, value)
+                if db_chunk.vector_id:
+                    payload_updates.append((db_chunk.vector_id, position))
+
+        await insert_chunks(db, document_id, added, new_vector_ids)
+
+        if settings.NEAR_DUPLICATE_ACTION != "off":
+            minhash = MinHash()
+            await asyncio.to_thread(minhash.update, [chunk["content"] for chunk in chunks])
+            match = await find_near_duplicate(db, document_id, minhash)
+            await save_signature(db, document_id, minhash, match)
+
+        # The new file goes into place before the commit, with the old one
+        # kept aside, so the stored hash never describes bytes that aren't there.
+        stash_path = processor.stash_file(old_storage_path)
+        storage_path = await processor.save_document(
+            str(document_id),
+            file_info["file_type"],
+            temp_path,
+        )
+
+        document.filename = file.filename
+        document.original_filename = file.filename
+        document.file_type = file_info["file_type"]
+        document.file_size_bytes = file_info["file_size_bytes"]
+        document.file_hash = file_info["file_hash"]
+        document.storage_path = storage_path
+        document.status = "ready"
+        document.error_message = None
+        document.chunks_count = len(chunks)
+        document.processed_at = datetime.utcnow()
+        await db.commit()
+        await bump_corpus_version()
+
+    except Exception as e:
+        if storage_path:
+            remove_file(storage_path)
+        if stash_path:
+            processor.restore_file(stash_path, old_storage_path)
+        processor.discard_upload(temp_path)
+        await db.rollback()
+        try:
+            await asyncio.to_thread(qdrant.delete_points, new_vector_ids)
+        except Exception as cleanup_error:
+            logger.error(f"Failed to remove new vectors for document {document_id}: {cleanup_error}")
+        raise HTTPException(status_code=500, detail=f"Processing failed: {e}")
+
+    if stash_path:
+        remove_file(stash_path)
+
+    # The replace has committed; stale vectors left behind by a failure here
+    # are only logged.
+    try:
+        await asyncio.to_thread(qdrant.delete_points, [row.vector_id for row in removed if row.vector_id])
+        await asyncio.to_thread(qdrant.update_payloads, payload_updates)
+    except Exception as e:
+        logger.error(f"Failed to update vectors for replaced document {document_id}: {e}")
+
+    return DocumentReplaceResponse(
+        id=document_id,
+        filename=file.filename,
+        status=DocumentStatus.READY,
+        message=f"Document updated: {len(added)} chunks added, {len(removed)} removed",
+        chunks_added=len(added),
+        chunks_removed=len(removed),
+        chunks_unchanged=len(kept),
+    )
+
+
 @router.get("/{document_id}/content")
 async def get_document_content(
     document_id: uuid.UUID,
+    request: Request,
+    v: Optional[str] = Query(None),
     db: AsyncSession = Depends(get_db),
 ):
     query = select(Document).where(
@@ -187,10 +485,23 @@ async def get_document_content(
     }
     media_type = media_types.get(document.file_type, "application/octet-stream")
 
+    # Content is addressed by file_hash, so a URL carrying the current hash
+    # can be cached forever; plain URLs revalidate against the ETag.
+    etag = f'"{document.file_hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL_IMMUTABLE if v == document.file_hash else CACHE_CONTROL_REVALIDATE,
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
     return FileResponse(
         path=file_path,
         filename=document.original_filename,
         media_type=media_type,
+        headers=headers,
     )
 
 
@@ -215,5 +526,6 @@ async def delete_document(
 
     document.deleted_at = datetime.utcnow()
     await db.commit()
+    await bump_corpus_version()
 
     return {"message": "Document deleted"}
@@ -53,13 +53,74 @@ class Settings(BaseSettings):
     MEMORY_RETENTION_DAYS_ISSUES: int = 90
     MEMORY_RETENTION_DAYS_ROUTINE: int = 7
 
-    CHUNK_SIZE: int = 4000
-    CHUNK_OVERLAP: int = 800
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_TTL: int = 24 * 3600
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+    ANSWER_CACHE_REPLAY_WORDS: int = 4
+
+    PROMPT_CONTEXT_WINDOW: int = 8192
+    PROMPT_CONTEXT_WINDOWS: dict[str, int] = {}
+    PROMPT_CONTEXT_SHARE: float = 0.6
+    PROMPT_MEMORY_SHARE: float = 0.1
+
+    SUMMARY_ENABLED: bool = True
+    SUMMARY_TRIGGER_MESSAGES: int = 10
+    SUMMARY_KEEP_MESSAGES: int = 4
+    SUMMARY_MAX_WORDS: int = 200
+
+    SESSION_CACHE_TTL: int = 24 * 3600
+    SESSION_CACHE_MESSAGES: int = 24
+
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_BACKPRESSURE: str = "wait"
+    WS_SEND_TIMEOUT: float = 10.0
+    WS_HEARTBEAT_INTERVAL: float = 20.0
+    WS_IDLE_TIMEOUT: float = 300.0
+    WS_COALESCE_WINDOW: float = 0.015
+    WS_COALESCE_MAX_CHARS: int = 1024
+
+    SSE_RESUME_GRACE: float = 5.0
+    SSE_RESUME_TTL: int = 300
+    SSE_KEEPALIVE_INTERVAL: float = 15.0
+
+    PERSIST_QUEUE_SIZE: int = 10000
+    PERSIST_BATCH_SIZE: int = 64
+    PERSIST_FLUSH_INTERVAL: float = 0.05
+
+    MAX_UPLOAD_SIZE: int = 100 * 1024 * 1024
+    MAX_ARCHIVE_SIZE: int = 1024 * 1024 * 1024
+    BULK_UPLOAD_MAX_FILES: int = 5000
+    # Each document in flight holds a pooled database connection for its
+    # whole ingest, so keep this below the pool size (5 + 10 overflow).
+    INGEST_DOCUMENT_CONCURRENCY: int = 4
+    INGEST_EXTRACT_CONCURRENCY: int = 4
+    INGEST_EMBED_CONCURRENCY: int = 2
+    INGEST_WRITE_CONCURRENCY: int = 4
+    INGEST_BATCH_SIZE: int = 256
+    NEAR_DUPLICATE_ACTION: str = "flag"
+    NEAR_DUPLICATE_THRESHOLD: float = 0.85
+    MINHASH_NUM_PERM: int = 128
+    MINHASH_BANDS: int = 16
+    MINHASH_SHINGLE_SIZE: int = 5
+    PDF_EXTRACT_WORKERS: int = 0
+    PDF_PARALLEL_MIN_PAGES: int = 64
+    PDF_PAGES_PER_TASK: int = 32
+    REINDEX_BATCH_SIZE: int = 64
+    REINDEX_MAX_PER_SECOND: float = 50.0
+
+    CHUNK_STRATEGY: str = "characters"
+    CHUNK_SIZE: int = 1000
+    CHUNK_OVERLAP: int = 200
+    CHUNK_PARENT_SIZE: int = 4000
+    CHUNK_TOKEN_SIZE: int = 256
+    CHUNK_TOKEN_OVERLAP: int = 32
     CHUNK_SEPARATORS: list[str] = ["\n\n", "\n", ". ", " ", ""]
+    CHUNK_STREAM_WINDOW: int = 1_000_000
 
     SEARXNG_BASE_URL: str = "http://searxng:8080"
     WEB_SEARCH_ENABLED: bool = True
     WEB_SEARCH_MAX_RESULTS: int = 5
+    WEB_SEARCH_MODE: str = "speculative"
     RAG_RELEVANCE_THRESHOLD: float = 0.65
 
     @property
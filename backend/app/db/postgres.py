@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Text, Integer, BigInteger, Float, Boolean, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import String, Text, Integer, BigInteger, Float, Boolean, ForeignKey, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -112,6 +112,41 @@ class DocumentChunk(Base):
     )
 
 
+class DocumentChunkingPolicy(Base):
+    __tablename__ = "document_chunking_policies"
+
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    strategy: Mapped[str] = mapped_column(String(20), nullable=False)
+    chunk_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    chunk_overlap: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+
+class DocumentSignature(Base):
+    __tablename__ = "document_signatures"
+
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    minhash: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    duplicate_of: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+    similarity: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+
+class DocumentSignatureBand(Base):
+    __tablename__ = "document_signature_bands"
+
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    band_index: Mapped[int] = mapped_column(Integer, primary_key=True)
+    band_hash: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index("idx_signature_bands_lookup", "band_index", "band_hash"),
+    )
+
+
 class DocumentAccess(Base):
     __tablename__ = "document_access"
 
@@ -142,6 +177,48 @@ class Conversation(Base):
     messages: Mapped[list["Message"]] = relationship(back_populates="conversation", cascade="all, delete-orphan")
 
 
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    conversation_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    summarized_until: Mapped[datetime] = mapped_column(nullable=False)
+    message_count: Mapped[int] = mapped_column(Integer, default=0)
+
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class TurnTiming(Base):
+    __tablename__ = "turn_timings"
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    session_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    model_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    context_source: Mapped[str] = mapped_column(String(20), nullable=False)
+    cache_hit: Mapped[bool] = mapped_column(Boolean, default=False)
+
+    # Milliseconds per stage; NULL when the stage didn't run in the turn.
+    embedding_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    documents_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    memory_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    history_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    web_search_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    prompt_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    first_token_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    generation_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    persist_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    total_ms: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_turn_timings_created", "created_at"),
+    )
+
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -159,3 +236,13 @@ class Message(Base):
     __table_args__ = (
         Index("idx_messages_conversation", "conversation_id"),
     )
+
+
+class MessageStatus(Base):
+    __tablename__ = "message_statuses"
+
+    # Only messages that didn't complete normally get a row.
+    message_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
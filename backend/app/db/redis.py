@@ -55,3 +55,9 @@ class RedisCache:
 
     async def ltrim(self, key: str, start: int, end: int):
         await self.client.ltrim(key, start, end)
+
+    async def hincrbyfloat(self, key: str, field: str, amount: float):
+        await self.client.hincrbyfloat(key, field, amount)
+
+    async def hgetall(self, key: str) -> dict:
+        return await self.client.hgetall(key)
@@ -15,6 +15,10 @@ from app.config import get_settings
 from app.db import init_db
 from app.db.redis import get_redis, close_redis
 from app.services.embedding import get_embedding_service, close_embedding_service
+from app.services.document import close_pdf_executor
+from app.services.persistence import close_persistence_queue
+from app.services.summary import close_conversation_summarizer
+from app.services.sse import close_sse_streams
 from app.api.documents import router as documents_router
 from app.api.chat import router as chat_router
 from app.api.admin import router as admin_router
@@ -59,7 +63,12 @@ async def lifespan(app: FastAPI):
     logger.info("Embedding service initialized")
     yield
     logger.info("Shutting down application")
+    # Cancelled streams hand their partial replies to the persistence queue.
+    await close_sse_streams()
+    await close_persistence_queue()
+    await close_conversation_summarizer()
     await close_embedding_service()
+    close_pdf_executor()
     await close_redis()
 
 
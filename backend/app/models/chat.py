@@ -36,6 +36,7 @@ class ChatHistoryMessage(BaseModel):
     role: str
     content: str
     created_at: datetime
+    status: str = "completed"
 
 
 class ChatHistoryResponse(BaseModel):
@@ -52,6 +53,7 @@ class WebSocketMessage(BaseModel):
     error_type: Optional[str] = None
     is_retryable: Optional[bool] = None
     source_info: Optional[SourceInfo] = None
+    timings: Optional[dict] = None
 
 
 class RateLimitInfo(BaseModel):
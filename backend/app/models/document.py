@@ -32,6 +32,7 @@ class DocumentResponse(DocumentBase):
     id: uuid.UUID
     original_filename: str
     file_size_bytes: int
+    file_hash: str
     status: DocumentStatus
     chunks_count: int
     visibility: DocumentVisibility
@@ -55,6 +56,28 @@ class DocumentUploadResponse(BaseModel):
     message: str
 
 
+class DocumentReplaceResponse(DocumentUploadResponse):
+    chunks_added: int = 0
+    chunks_removed: int = 0
+    chunks_unchanged: int = 0
+
+
+class BulkUploadFileResult(BaseModel):
+    filename: str
+    status: str
+    document_id: Optional[uuid.UUID] = None
+    chunks_count: Optional[int] = None
+    message: Optional[str] = None
+
+
+class BulkUploadJobResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    processed: int
+    results: list[BulkUploadFileResult]
+
+
 class DocumentUpdate(BaseModel):
     filename: Optional[str] = None
     visibility: Optional[DocumentVisibility] = None
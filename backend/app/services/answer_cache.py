@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from app.config import Settings, get_settings
+from app.db.redis import RedisCache, get_redis
+
+logger = logging.getLogger(__name__)
+
+CORPUS_VERSION_KEY = "corpus:version"
+ANSWER_CACHE_PREFIX = "answer_cache:"
+ANSWER_CACHE_METRICS_KEY = "metrics:answer_cache"
+BUCKET_BITS = 16
+BUCKET_CAPACITY = 32
+# Rough characters per token, used only to estimate output tokens saved.
+CHARS_PER_TOKEN = 4
+
+_WORD_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _SPACE_RE.sub(" ", _WORD_RE.sub(" ", question.lower())).strip()
+
+
+async def get_corpus_version() -> int:
+    cache = RedisCache(await get_redis())
+    return int(await cache.get(CORPUS_VERSION_KEY) or 0)
+
+
+async def bump_corpus_version() -> None:
+    # Any change to the searchable documents invalidates every cached answer
+    # at once, since the version is part of the key.
+    try:
+        cache = RedisCache(await get_redis())
+        await cache.incr(CORPUS_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Failed to bump corpus version: {e}")
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    source_type: str
+    sources: list[str] = field(default_factory=list)
+    generation_seconds: float = 0.0
+
+
+class AnswerCache:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.enabled = self.settings.ANSWER_CACHE_ENABLED
+        self._planes: Optional[np.ndarray] = None
+
+    def _bucket(self, vector: list[float]) -> str:
+        # Random-hyperplane signature: paraphrases with nearby embeddings land
+        # in the same bucket, where candidates are compared exactly.
+        if self._planes is None or self._planes.shape[1] != len(vector):
+            rng = np.random.default_rng(0)
+            self._planes = rng.standard_normal((BUCKET_BITS, len(vector)))
+        bits = self._planes @ np.asarray(vector) > 0
+        return f"{int(np.packbits(bits).view('>u2')[0]):04x}"
+
+    def _prefix(self, corpus_version: int, model_key: str) -> str:
+        return f"{ANSWER_CACHE_PREFIX}{corpus_version}:{model_key}:"
+
+    async def _record(self, **fields: float) -> None:
+        try:
+            cache = RedisCache(await get_redis())
+            for name, amount in fields.items():
+                await cache.hincrbyfloat(ANSWER_CACHE_METRICS_KEY, name, amount)
+        except Exception as e:
+            logger.warning(f"Failed to record answer cache metrics: {e}")
+
+    async def record_skip(self) -> None:
+        await self._record(skipped=1)
+
+    async def lookup(
+        self,
+        question: str,
+        query_vector: list[float],
+        model_key: str,
+    ) -> Optional[CachedAnswer]:
+        cache = RedisCache(await get_redis())
+        prefix = self._prefix(await get_corpus_version(), model_key)
+        question_hash = hashlib.sha256(normalize_question(question).encode()).hexdigest()
+
+        data = await cache.get(f"{prefix}q:{question_hash}")
+        if data is None:
+            best_score = self.settings.ANSWER_CACHE_SIMILARITY
+            best_hash = None
+            query = np.asarray(query_vector)
+            query_norm = np.linalg.norm(query) or 1.0
+            for raw in await cache.lrange(f"{prefix}b:{self._bucket(query_vector)}", 0, -1):
+                candidate = json.loads(raw)
+                vector = np.asarray(candidate["vector"])
+                score = float(query @ vector / (query_norm * (np.linalg.norm(vector) or 1.0)))
+                if score >= best_score:
+                    best_score, best_hash = score, candidate["hash"]
+            if best_hash:
+                data = await cache.get(f"{prefix}q:{best_hash}")
+
+        if data is None:
+            await self._record(lookups=1)
+            return None
+
+        answer = CachedAnswer(**json.loads(data))
+        await self._record(
+            lookups=1,
+            hits=1,
+            generation_seconds_saved=answer.generation_seconds,
+            output_tokens_saved=len(answer.answer) / CHARS_PER_TOKEN,
+        )
+        return answer
+
+    async def store(
+        self,
+        question: str,
+        query_vector: list[float],
+        model_key: str,
+        answer: CachedAnswer,
+    ) -> None:
+        try:
+            cache = RedisCache(await get_redis())
+            prefix = self._prefix(await get_corpus_version(), model_key)
+            ttl = self.settings.ANSWER_CACHE_TTL
+            question_hash = hashlib.sha256(normalize_question(question).encode()).hexdigest()
+
+            await cache.set(f"{prefix}q:{question_hash}", json.dumps(asdict(answer)), expire=ttl)
+
+            bucket_key = f"{prefix}b:{self._bucket(query_vector)}"
+            await cache.lpush(bucket_key, json.dumps({"hash": question_hash, "vector": query_vector}))
+            await cache.ltrim(bucket_key, 0, BUCKET_CAPACITY - 1)
+            await cache.expire(bucket_key, ttl)
+            await self._record(stores=1)
+        except Exception as e:
+            logger.warning(f"Failed to store cached answer: {e}")
+
+
+async def get_answer_cache_metrics() -> dict:
+    cache = RedisCache(await get_redis())
+    data = {k: float(v) for k, v in (await cache.hgetall(ANSWER_CACHE_METRICS_KEY)).items()}
+
+    lookups = int(data.get("lookups", 0))
+    hits = int(data.get("hits", 0))
+    return {
+        "enabled": get_settings().ANSWER_CACHE_ENABLED,
+        "corpus_version": await get_corpus_version(),
+        "lookups": lookups,
+        "hits": hits,
+        "skipped": int(data.get("skipped", 0)),
+        "stores": int(data.get("stores", 0)),
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "generation_seconds_saved": round(data.get("generation_seconds_saved", 0.0), 1),
+        "estimated_output_tokens_saved": int(data.get("output_tokens_saved", 0)),
+    }
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
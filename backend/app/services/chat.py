@@ -1,23 +1,39 @@
 import logging
 import asyncio
+import re
+import time
+from contextlib import aclosing, nullcontext
+from datetime import datetime
 from typing import Optional, AsyncIterator
 from uuid import UUID
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from langchain_core.messages import BaseMessage
 
 from app.config import get_settings
+from app.db.redis import RedisCache, get_redis
+from app.services.answer_cache import CachedAnswer, get_answer_cache
+from app.services.embedding import get_embedding_service
+from app.services.latency import TurnTimer
 from app.services.llm import get_llm_service
 from app.services.memory import get_memory_service
+from app.services.persistence import TurnRecord, get_persistence_queue, persist_turns
+from app.services.prompt_budget import PromptPlan, count_tokens, get_prompt_budgeter
 from app.services.qdrant import get_qdrant_service
-from app.services.web_search import get_web_search_service
-from app.db.postgres import Conversation, Message
+from app.services.session_cache import get_session_cache, merge_messages
+from app.services.summary import get_conversation_summarizer
+from app.services.web_search import WebSearchResult, get_web_search_service
+from app.db.postgres import LLMModel
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+WEB_SEARCH_METRICS_KEY = "metrics:web_search"
+
+_REPLAY_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
 
 class ContextSource(str, Enum):
     DOCUMENTS = "documents"
@@ -25,11 +41,35 @@ class ContextSource(str, Enum):
     NONE = "none"
 
 
+CONTEXT_SEPARATORS = {
+    ContextSource.DOCUMENTS: "\n\n",
+    ContextSource.WEB: "\n\n---\n\n",
+}
+
+
 @dataclass
 class ContextResult:
     source: ContextSource
     content: str
     sources: list[str]
+    # The pieces content is joined from, best first, so the prompt budget can
+    # drop the weakest ones.
+    chunks: list[str] = field(default_factory=list)
+
+
+@dataclass
+class TurnContext:
+    context_result: ContextResult
+    memory_snippets: list[str]
+    summary: str
+    chat_history: list[dict]
+    query_vector: list[float]
+    timer: TurnTimer
+    model: LLMModel
+    # The answer cache's model key when the turn may be stored, and the
+    # answer when it was found there.
+    cache_key: Optional[str] = None
+    cached: Optional[CachedAnswer] = None
 
 
 SYSTEM_PROMPT_DOCUMENTS = """
@@ -108,7 +148,11 @@ class ChatService:
         self.llm = get_llm_service()
         self.memory = None
         self.qdrant = get_qdrant_service()
+        self.embedding_service = get_embedding_service()
         self.web_search = get_web_search_service()
+        self.answer_cache = get_answer_cache()
+        self.prompt_budgeter = get_prompt_budgeter()
+        self.session_cache = get_session_cache()
         self.relevance_threshold = settings.RAG_RELEVANCE_THRESHOLD
         self.web_search_enabled = settings.WEB_SEARCH_ENABLED
 
@@ -117,13 +161,25 @@ class ChatService:
             self.memory = await get_memory_service()
         return self.memory
 
-    async def _get_rag_context(self, query: str, limit: int = 5) -> tuple[str, float]:
-        results = await self.qdrant.search(query=query, limit=limit)
-
-        if not results:
-            return "", 0.0
-
-        top_score = results[0].get("score", 0.0) if results else 0.0
+    async def _search_documents(
+        self,
+        query: str,
+        limit: int = 5,
+        query_vector: Optional[list[float]] = None,
+    ) -> tuple[list[dict], float]:
+        hits = await self.qdrant.search(query=query, limit=limit, query_vector=query_vector)
+        top_score = hits[0].get("score", 0.0) if hits else 0.0
+        return hits, top_score
+
+    async def _get_rag_context(
+        self,
+        db: AsyncSession,
+        hits: list[dict],
+        limit: int = 5,
+    ) -> list[str]:
+        # Parent text is read on the turn's session, once the concurrent
+        # stages are done with it.
+        results = await self.qdrant.expand_parents(db, hits, limit)
 
         context_parts = []
         for result in results:
@@ -131,28 +187,67 @@ class ChatService:
             if content:
                 context_parts.append(content)
 
-        return "\n\n".join(context_parts), top_score
+        return context_parts
 
-    async def _get_context_with_fallback(self, query: str) -> ContextResult:
-        if self.web_search_enabled:
-            rag_task = self._get_rag_context(query)
-            web_task = self.web_search.search(
-                query=query,
-                num_results=settings.WEB_SEARCH_MAX_RESULTS
-            )
-            (rag_context, top_score), web_results = await asyncio.gather(
-                rag_task, web_task
-            )
-        else:
-            rag_context, top_score = await self._get_rag_context(query)
-            web_results = []
+    async def _get_web_results(self, query: str) -> tuple[list[WebSearchResult], float]:
+        started = time.perf_counter()
+        results = await self.web_search.search(
+            query=query,
+            num_results=settings.WEB_SEARCH_MAX_RESULTS
+        )
+        return results, time.perf_counter() - started
+
+    async def _record_web_search(self, **fields: float) -> None:
+        try:
+            cache = RedisCache(await get_redis())
+            for field, amount in fields.items():
+                await cache.hincrbyfloat(WEB_SEARCH_METRICS_KEY, field, amount)
+        except Exception as e:
+            logger.warning(f"Failed to record web search metrics: {e}")
+
+    async def _finish_web_search(
+        self,
+        web_task: Optional[asyncio.Task],
+        web_started: float,
+        query: str,
+        rag_hit: bool,
+    ) -> list[WebSearchResult]:
+        if not self.web_search_enabled:
+            return []
+
+        if rag_hit:
+            if web_task and web_task.done() and not web_task.cancelled():
+                # The search finished before the documents came back.
+                _, duration = web_task.result()
+                await self._record_web_search(calls=1, call_seconds=duration)
+                return []
+
+            # A speculative search was cancelled when the documents came back;
+            # in after_miss mode it never started.
+            elapsed = time.perf_counter() - web_started if web_task else 0.0
+            await self._record_web_search(avoided=1, cancelled_seconds=elapsed)
+            return []
+
+        if web_task is None:
+            web_task = asyncio.create_task(self._get_web_results(query))
+        web_results, duration = await web_task
+        await self._record_web_search(calls=1, call_seconds=duration)
+        return web_results
 
+    def _select_context(
+        self,
+        rag_chunks: list[str],
+        top_score: float,
+        web_results: list[WebSearchResult],
+    ) -> ContextResult:
+        rag_context = CONTEXT_SEPARATORS[ContextSource.DOCUMENTS].join(rag_chunks)
         if rag_context and top_score >= self.relevance_threshold:
             logger.info(f"Using RAG context (score: {top_score:.3f})")
             return ContextResult(
                 source=ContextSource.DOCUMENTS,
                 content=rag_context,
-                sources=[]
+                sources=[],
+                chunks=rag_chunks,
             )
 
         if web_results:
@@ -160,14 +255,16 @@ class ChatService:
             return ContextResult(
                 source=ContextSource.WEB,
                 content=self.web_search.format_results(web_results),
-                sources=self.web_search.get_source_urls(web_results)
+                sources=self.web_search.get_source_urls(web_results),
+                chunks=[self.web_search.format_results([result]) for result in web_results],
             )
 
         if rag_context:
             return ContextResult(
                 source=ContextSource.DOCUMENTS,
                 content=rag_context,
-                sources=[]
+                sources=[],
+                chunks=rag_chunks,
             )
 
         return ContextResult(
@@ -176,15 +273,214 @@ class ChatService:
             sources=[]
         )
 
-    async def _get_memory_context(self, query: str, user_id: str) -> str:
+    async def _get_memory_context(
+        self,
+        query: str,
+        user_id: str,
+        query_vector: Optional[list[float]] = None,
+    ) -> list[str]:
         memory = await self._get_memory()
-        context = await memory.get_context(
+        snippets, _ = await memory.get_scored_snippets(
             query=query,
             user_id=user_id,
             limit=5,
+            query_vector=query_vector,
         )
-        logger.info(f"Memory context for user {user_id}: {context[:200] if context else 'empty'}")
-        return context
+        logger.info(f"Memory context for user {user_id}: {len(snippets)} snippets")
+        return snippets
+
+    async def _plan_turn(
+        self,
+        db: AsyncSession,
+        message: str,
+        session_id: str,
+        user_id: str,
+        model_id: Optional[UUID],
+        timer: TurnTimer,
+    ) -> TurnContext:
+        # The message is embedded once for both the document and memory
+        # searches; history doesn't need the vector and runs alongside the
+        # embedding. Memories and history decide whether the answer cache may
+        # be used, so they are awaited first: a hit ends the turn's planning
+        # there and the document and web searches still in flight are
+        # dropped. Web search starts speculatively and is dropped as soon as
+        # the documents are relevant enough, or with WEB_SEARCH_MODE=after_miss
+        # only starts once they are not.
+        async def embed() -> list[float]:
+            with timer.stage("embedding"):
+                return await self.embedding_service.embed(message)
+
+        query_vector = asyncio.ensure_future(embed())
+
+        web_task = None
+        web_started = time.perf_counter()
+        if self.web_search_enabled and settings.WEB_SEARCH_MODE == "speculative":
+            web_task = asyncio.create_task(self._get_web_results(message))
+
+        async def documents() -> tuple[list[dict], float]:
+            vector = await query_vector
+            started = time.perf_counter()
+            hits, top_score = await self._search_documents(message, query_vector=vector)
+            # Recorded only once done, so a search dropped on a cache hit
+            # isn't counted.
+            timer.record("documents", time.perf_counter() - started)
+            if web_task and hits and top_score >= self.relevance_threshold:
+                web_task.cancel()
+            return hits, top_score
+
+        async def memories() -> list[str]:
+            vector = await query_vector
+            with timer.stage("memory"):
+                return await self._get_memory_context(message, user_id, query_vector=vector)
+
+        async def history() -> tuple[str, list[dict]]:
+            with timer.stage("history"):
+                return await self.get_chat_history(db, session_id, limit=settings.SUMMARY_TRIGGER_MESSAGES + 2)
+
+        documents_task = asyncio.ensure_future(documents())
+        try:
+            memory_snippets, (summary, chat_history) = await asyncio.gather(memories(), history())
+            model, _ = await self.llm.resolve_model_config(db, model_id)
+            timer.model_name = model.model_name
+
+            cacheable = not (summary or chat_history or memory_snippets)
+            cache_key, cached = await self._lookup_answer(model, message, query_vector.result(), cacheable)
+            if cached:
+                return TurnContext(
+                    context_result=ContextResult(
+                        source=ContextSource(cached.source_type),
+                        content="",
+                        sources=cached.sources,
+                    ),
+                    memory_snippets=memory_snippets,
+                    summary=summary,
+                    chat_history=chat_history,
+                    query_vector=query_vector.result(),
+                    timer=timer,
+                    model=model,
+                    cached=cached,
+                )
+
+            hits, top_score = await documents_task
+            with timer.stage("documents"):
+                rag_chunks = await self._get_rag_context(db, hits)
+            rag_hit = bool(rag_chunks) and top_score >= self.relevance_threshold
+            # Only a search the turn actually waits on counts as a stage.
+            waits_on_web = self.web_search_enabled and not rag_hit
+            with timer.stage("web_search") if waits_on_web else nullcontext():
+                web_results = await self._finish_web_search(web_task, web_started, message, rag_hit)
+        finally:
+            query_vector.cancel()
+            documents_task.cancel()
+            if web_task:
+                web_task.cancel()
+
+        context_result = self._select_context(rag_chunks, top_score, web_results)
+        if context_result.source == ContextSource.WEB:
+            # Web results go stale without the corpus version changing.
+            cache_key = None
+
+        return TurnContext(
+            context_result=context_result,
+            memory_snippets=memory_snippets,
+            summary=summary,
+            chat_history=chat_history,
+            query_vector=query_vector.result(),
+            timer=timer,
+            model=model,
+            cache_key=cache_key,
+        )
+
+    async def _lookup_answer(
+        self,
+        model: LLMModel,
+        message: str,
+        query_vector: list[float],
+        cacheable: bool,
+    ) -> tuple[Optional[str], Optional[CachedAnswer]]:
+        # Answers are only shared between turns that don't lean on anything
+        # user-specific: no earlier messages in the conversation and no
+        # memories in the prompt, however weakly they matched. Returns the
+        # cache's model key when the turn is cacheable, plus any hit.
+        if not self.answer_cache.enabled:
+            return None, None
+
+        if not cacheable:
+            await self.answer_cache.record_skip()
+            return None, None
+
+        try:
+            model_key = str(model.id)
+            return model_key, await self.answer_cache.lookup(message, query_vector, model_key)
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+            return None, None
+
+    async def _store_answer(
+        self,
+        message: str,
+        turn: TurnContext,
+        answer: str,
+        generation_seconds: float,
+    ) -> None:
+        if turn.cache_key and answer:
+            await self.answer_cache.store(message, turn.query_vector, turn.cache_key, CachedAnswer(
+                answer=answer,
+                source_type=turn.context_result.source.value,
+                sources=turn.context_result.sources,
+                generation_seconds=generation_seconds,
+            ))
+
+    def _replay_chunks(self, answer: str) -> list[str]:
+        tokens = _REPLAY_TOKEN_RE.findall(answer)
+        size = settings.ANSWER_CACHE_REPLAY_WORDS
+        return ["".join(tokens[i:i + size]) for i in range(0, len(tokens), size)]
+
+    def _build_messages(
+        self,
+        model: LLMModel,
+        message: str,
+        session_id: str,
+        turn: TurnContext,
+    ) -> list[BaseMessage]:
+        with turn.timer.stage("prompt"):
+            messages, plan = self._fit_prompt(model, message, turn)
+        turn.timer.prompt_tokens = plan.total_tokens
+        logger.info(f"Prompt for session {session_id} ({model.model_name}): {plan.describe()}")
+        return messages
+
+    def _fit_prompt(
+        self,
+        model: LLMModel,
+        message: str,
+        turn: TurnContext,
+    ) -> tuple[list[BaseMessage], PromptPlan]:
+        context_result = turn.context_result
+        separator = CONTEXT_SEPARATORS.get(context_result.source, "\n\n")
+        summary = f"\nSummary of the earlier conversation:\n{turn.summary}\n" if turn.summary else ""
+        plan = self.prompt_budgeter.fit(
+            model=model,
+            fixed=[
+                self._build_system_prompt(replace(context_result, content="", chunks=[]), ""),
+                summary,
+                message,
+            ],
+            context_chunks=context_result.chunks,
+            context_separator=separator,
+            memory_snippets=turn.memory_snippets,
+            chat_history=turn.chat_history,
+        )
+
+        if context_result.chunks:
+            context_result = replace(context_result, content=separator.join(plan.context_chunks))
+        system_prompt = self._build_system_prompt(context_result, "\n".join(plan.memory_snippets)) + summary
+
+        messages = self.llm.create_messages(
+            user_message=message,
+            system_prompt=system_prompt,
+            chat_history=plan.chat_history,
+        )
+        return messages, plan
 
     def _build_system_prompt(
         self,
@@ -218,71 +514,27 @@ class ChatService:
             logger.warning(f"Failed to update memory for user {user_id}: {e}")
             return False
 
-    async def get_or_create_conversation(
-        self,
-        db: AsyncSession,
-        session_id: str,
-        user_id: str,
-    ) -> Conversation:
-        result = await db.execute(
-            select(Conversation).where(Conversation.session_id == session_id)
-        )
-        conversation = result.scalar_one_or_none()
-
-        if not conversation:
-            conversation = Conversation(session_id=session_id, user_id=user_id)
-            db.add(conversation)
-            await db.commit()
-            await db.refresh(conversation)
-
-        return conversation
-
-    async def save_message(
-        self,
-        db: AsyncSession,
-        conversation_id,
-        role: str,
-        content: str,
-    ) -> Message:
-        message = Message(
-            conversation_id=conversation_id,
-            role=role,
-            content=content,
-        )
-        db.add(message)
-        await db.commit()
-        await db.refresh(message)
-        return message
-
     async def get_chat_history(
         self,
         db: AsyncSession,
         session_id: str,
         limit: int = 20,
-    ) -> list[dict]:
-        result = await db.execute(
-            select(Conversation).where(Conversation.session_id == session_id)
-        )
-        conversation = result.scalar_one_or_none()
-
-        if not conversation:
-            return []
-
-        result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation.id)
-            .order_by(Message.created_at.desc())
-            .limit(limit)
-        )
-        messages = result.scalars().all()
-
-        return [
-            {
-                "role": msg.role,
-                "content": msg.content,
-            }
-            for msg in reversed(messages)
-        ]
+    ) -> tuple[str, list[dict]]:
+        # Returns the conversation summary and the raw messages it doesn't
+        # cover yet, from the session cache, rebuilt from Postgres on a miss.
+        # Turns still waiting in the write-behind queue are part of the
+        # history; they are taken before reading so none fall in between.
+        pending = get_persistence_queue().pending_messages(session_id)
+
+        state = await self.session_cache.get(session_id)
+        if state is None:
+            state = await self.session_cache.rebuild(db, session_id, pending)
+
+        history = merge_messages(state.messages, pending)
+        if state.summarized_until:
+            summarized_until = datetime.fromisoformat(state.summarized_until)
+            history = [m for m in history if datetime.fromisoformat(m["created_at"]) > summarized_until]
+        return state.summary, history[-limit:]
 
     async def chat(
         self,
@@ -292,23 +544,31 @@ class ChatService:
         user_id: str,
         model_id: Optional[UUID] = None,
     ) -> tuple[str, bool, ContextResult]:
-        context_result = await self._get_context_with_fallback(message)
-        memory_context = await self._get_memory_context(message, user_id)
-        system_prompt = self._build_system_prompt(context_result, memory_context)
-
-        chat_history = await self.get_chat_history(db, session_id, limit=10)
-
-        messages = self.llm.create_messages(
-            user_message=message,
-            system_prompt=system_prompt,
-            chat_history=chat_history,
-        )
-
-        response = await self.llm.invoke(db, messages, model_id)
-
-        conversation = await self.get_or_create_conversation(db, session_id, user_id)
-        await self.save_message(db, conversation.id, "user", message)
-        await self.save_message(db, conversation.id, "assistant", response)
+        started_at = datetime.utcnow()
+        timer = TurnTimer()
+        turn = await self._plan_turn(db, message, session_id, user_id, model_id, timer)
+        context_result = turn.context_result
+
+        if turn.cached:
+            response = turn.cached.answer
+            timer.cache_hit = True
+        else:
+            messages = self._build_messages(turn.model, message, session_id, turn)
+            generation_started = time.perf_counter()
+            with timer.stage("generation"):
+                response = await self.llm.invoke(db, messages, model_id)
+            await self._store_answer(message, turn, response, time.perf_counter() - generation_started)
+
+        with timer.stage("persist"):
+            await persist_turns(db, [TurnRecord(
+                session_id=session_id,
+                user_id=user_id,
+                user_message=message,
+                assistant_message=response,
+                started_at=started_at,
+            )])
+        get_conversation_summarizer().schedule(session_id)
+        self._finish_timer(timer, session_id, context_result, response)
 
         memory_updated = await self._update_memory(user_id, message, response)
 
@@ -321,35 +581,99 @@ class ChatService:
         session_id: str,
         user_id: str,
         model_id: Optional[UUID] = None,
+        timer: Optional[TurnTimer] = None,
     ) -> AsyncIterator[tuple[str, Optional[ContextResult]]]:
-        context_result = await self._get_context_with_fallback(message)
-        memory_context = await self._get_memory_context(message, user_id)
-        system_prompt = self._build_system_prompt(context_result, memory_context)
-
-        chat_history = await self.get_chat_history(db, session_id, limit=10)
-
-        messages = self.llm.create_messages(
-            user_message=message,
-            system_prompt=system_prompt,
-            chat_history=chat_history,
-        )
-
+        # Pass a timer to read the turn's latency breakdown once the stream
+        # is exhausted.
+        started_at = datetime.utcnow()
+        timer = timer or TurnTimer()
         full_response = ""
-        first_chunk = True
 
-        async for chunk in self.llm.stream(db, messages, model_id):
-            full_response += chunk
-            if first_chunk:
-                yield chunk, context_result
-                first_chunk = False
+        try:
+            turn = await self._plan_turn(db, message, session_id, user_id, model_id, timer)
+            context_result = turn.context_result
+
+            if turn.cached:
+                # Replayed over the same token protocol as a live generation.
+                timer.cache_hit = True
+                for i, chunk in enumerate(self._replay_chunks(turn.cached.answer)):
+                    full_response += chunk
+                    yield chunk, context_result if i == 0 else None
             else:
-                yield chunk, None
-
-        conversation = await self.get_or_create_conversation(db, session_id, user_id)
-        await self.save_message(db, conversation.id, "user", message)
-        await self.save_message(db, conversation.id, "assistant", full_response)
+                messages = self._build_messages(turn.model, message, session_id, turn)
+                first_chunk = True
+                generation_started = time.perf_counter()
+
+                async with aclosing(self.llm.stream(db, messages, model_id)) as stream:
+                    async for chunk in stream:
+                        full_response += chunk
+                        if first_chunk:
+                            timer.record("first_token", time.perf_counter() - generation_started)
+                            yield chunk, context_result
+                            first_chunk = False
+                        else:
+                            yield chunk, None
+                timer.record("generation", time.perf_counter() - generation_started)
+
+                await self._store_answer(message, turn, full_response, time.perf_counter() - generation_started)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client stopped the turn or went away: closing the provider
+            # stream above ends the generation, and whatever was produced is
+            # kept, flagged as cancelled.
+            await get_persistence_queue().submit(TurnRecord(
+                session_id=session_id,
+                user_id=user_id,
+                user_message=message,
+                assistant_message=full_response,
+                started_at=started_at,
+                status="cancelled",
+            ))
+            logger.info(f"Turn cancelled for session {session_id} after {len(full_response)} characters")
+            raise
+
+        # Messages and the memory update are written behind, so the turn ends
+        # as soon as the last token is out.
+        with timer.stage("persist"):
+            await get_persistence_queue().submit(TurnRecord(
+                session_id=session_id,
+                user_id=user_id,
+                user_message=message,
+                assistant_message=full_response,
+                started_at=started_at,
+            ))
+        self._finish_timer(timer, session_id, context_result, full_response)
 
-        await self._update_memory(user_id, message, full_response)
+    def _finish_timer(
+        self,
+        timer: TurnTimer,
+        session_id: str,
+        context_result: ContextResult,
+        response: str,
+    ) -> None:
+        timer.context_source = context_result.source.value
+        timer.completion_tokens = count_tokens(response)
+        timer.finish()
+        get_persistence_queue().record_timing(timer.to_row(session_id))
+
+
+async def get_web_search_metrics() -> dict:
+    cache = RedisCache(await get_redis())
+    data = {k: float(v) for k, v in (await cache.hgetall(WEB_SEARCH_METRICS_KEY)).items()}
+
+    calls = int(data.get("calls", 0))
+    avoided = int(data.get("avoided", 0))
+    avg_call_ms = data.get("call_seconds", 0.0) * 1000 / calls if calls else 0.0
+    # Each avoided call would have cost about the average call; for cancelled
+    # speculative calls the time already spent in flight is not a saving.
+    saved_ms = max(avoided * avg_call_ms - data.get("cancelled_seconds", 0.0) * 1000, 0.0)
+
+    return {
+        "mode": settings.WEB_SEARCH_MODE,
+        "calls": calls,
+        "avoided": avoided,
+        "avg_call_ms": round(avg_call_ms, 1),
+        "estimated_latency_saved_ms": round(saved_ms, 1),
+    }
 
 
 _chat_service: Optional[ChatService] = None
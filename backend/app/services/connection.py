@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import msgpack
+import orjson
+from fastapi import WebSocket
+
+from app.config import Settings, get_settings
+from app.models.chat import WebSocketMessage
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("wait", "disconnect")
+
+# Close codes: policy violation for clients that can't keep up, going away
+# for idle connections.
+CLOSE_SLOW_CLIENT = 1008
+CLOSE_IDLE = 1001
+
+# Binary protocol for bandwidth-constrained clients: frames are MessagePack
+# maps with null fields left out and the type as a small integer. Clients send
+# their frames the same way. JSON stays the default.
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+FRAME_TYPE_CODES = {
+    "token": 1,
+    "complete": 2,
+    "error": 3,
+    "llm_error": 4,
+    "rate_limited": 5,
+    "cancelled": 6,
+    "ping": 7,
+    "pong": 8,
+    "message": 9,
+    "cancel": 10,
+}
+FRAME_TYPE_NAMES = {code: name for name, code in FRAME_TYPE_CODES.items()}
+# packb builds a new Packer on every call.
+_packer = msgpack.Packer()
+
+
+def encode_json(frame: dict) -> str:
+    return orjson.dumps(frame).decode()
+
+
+def encode_msgpack(frame: dict) -> bytes:
+    packed = {key: value for key, value in frame.items() if value is not None}
+    packed["type"] = FRAME_TYPE_CODES.get(frame["type"], frame["type"])
+    return _packer.pack(packed)
+
+
+def decode_msgpack(data: bytes) -> dict:
+    frame = msgpack.unpackb(data)
+    if not isinstance(frame, dict):
+        raise ValueError("Expected a MessagePack map")
+    frame["type"] = FRAME_TYPE_NAMES.get(frame.get("type"), frame.get("type"))
+    return frame
+
+
+# Token frames are the bulk of the traffic, so they are copied from a template
+# instead of going through the model; the shape stays the same.
+TOKEN_FRAME = WebSocketMessage(type="token").model_dump()
+
+
+def token_frame(content: str, source_info: Optional[dict] = None) -> dict:
+    frame = TOKEN_FRAME.copy()
+    frame["content"] = content
+    if source_info is not None:
+        frame["source_info"] = source_info
+    return frame
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class ChatConnection:
+    # Frames go through a bounded queue drained by a single writer task, so a
+    # generation never waits on a socket write unless the queue is full; what
+    # happens then is set by WS_BACKPRESSURE. The writer also sends heartbeat
+    # pings whenever the connection has been quiet for a while.
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        settings: Optional[Settings] = None,
+        coalesce: bool = False,
+        subprotocol: Optional[str] = None,
+    ):
+        self.websocket = websocket
+        self.settings = settings or get_settings()
+        self.coalesce = coalesce
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        if self.settings.WS_BACKPRESSURE not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown WS_BACKPRESSURE policy: {self.settings.WS_BACKPRESSURE}")
+
+        self._outbound: asyncio.Queue[dict] = asyncio.Queue(maxsize=self.settings.WS_SEND_QUEUE_SIZE)
+        self._writer: Optional[asyncio.Task] = None
+        self._closed = asyncio.Event()
+        # A frame read while coalescing that couldn't be merged.
+        self._held: Optional[dict] = None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def send(self, frame: dict) -> None:
+        if self.closed:
+            raise ConnectionClosed()
+
+        try:
+            self._outbound.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            if self.settings.WS_BACKPRESSURE == "disconnect":
+                await self._drop_slow_client()
+
+        try:
+            await asyncio.wait_for(self._outbound.put(frame), self.settings.WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self._drop_slow_client()
+
+    async def _drop_slow_client(self) -> None:
+        logger.warning(f"Closing WebSocket: client not reading ({self._outbound.qsize()} frames queued)")
+        await self.close(CLOSE_SLOW_CLIENT, "Client too slow")
+        raise ConnectionClosed()
+
+    async def receive(self, is_idle: Callable[[], bool]) -> Optional[dict]:
+        # Returns None once the client has been silent past the idle timeout
+        # with nothing streaming; while a response streams, silence is fine.
+        while True:
+            try:
+                return await asyncio.wait_for(self._receive_frame(), self.settings.WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if is_idle():
+                    return None
+
+    async def _receive_frame(self) -> dict:
+        if self.binary:
+            return decode_msgpack(await self.websocket.receive_bytes())
+        return await self.websocket.receive_json()
+
+    async def _send_frame(self, frame: dict) -> None:
+        if self.binary:
+            await self.websocket.send_bytes(encode_msgpack(frame))
+        else:
+            await self.websocket.send_text(encode_json(frame))
+
+    async def _next_frame(self, timeout: float) -> dict:
+        if self._held is not None:
+            frame, self._held = self._held, None
+            return frame
+        try:
+            return self._outbound.get_nowait()
+        except asyncio.QueueEmpty:
+            return await asyncio.wait_for(self._outbound.get(), timeout)
+
+    async def _coalesce(self, frame: dict) -> dict:
+        # Tokens that arrive within the window are sent as one frame. Only
+        # the first may carry source_info; anything else ends the frame and
+        # goes out next, so order is kept.
+        parts = [frame["content"]]
+        size = len(frame["content"])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.settings.WS_COALESCE_WINDOW
+
+        while size < self.settings.WS_COALESCE_MAX_CHARS:
+            try:
+                following = await self._next_frame(max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if following["type"] != "token" or following.get("source_info"):
+                self._held = following
+                break
+            parts.append(following["content"])
+            size += len(following["content"])
+
+        if len(parts) > 1:
+            frame = {**frame, "content": "".join(parts)}
+        return frame
+
+    async def _write_loop(self) -> None:
+        interval = self.settings.WS_HEARTBEAT_INTERVAL
+        try:
+            while True:
+                try:
+                    frame = await self._next_frame(interval)
+                except asyncio.TimeoutError:
+                    frame = {"type": "ping"}
+                if self.coalesce and frame["type"] == "token":
+                    frame = await self._coalesce(frame)
+                await self._send_frame(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WebSocket writer stopped: {e}")
+        finally:
+            self._closed.set()
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed and self._writer is None:
+            return
+
+        self._closed.set()
+        if self._writer:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # Already closed by the client.
+            pass
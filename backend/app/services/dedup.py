@@ -0,0 +1,158 @@
+import hashlib
+import re
+import uuid
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.db.postgres import Document, DocumentSignature, DocumentSignatureBand
+
+settings = get_settings()
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_RE = re.compile(r"\w+")
+SHINGLE_BATCH_SIZE = 4096
+
+
+class NearDuplicateError(Exception):
+    def __init__(self, duplicate_of: uuid.UUID, similarity: float):
+        self.duplicate_of = duplicate_of
+        self.similarity = similarity
+        super().__init__(
+            f"Near-duplicate of document {duplicate_of} (similarity {similarity:.2f})"
+        )
+
+
+@lru_cache
+def _permutations(num_perm: int) -> tuple[np.ndarray, np.ndarray]:
+    # Fixed seed so signatures computed in different processes are comparable.
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _hash_shingle(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little")
+
+
+class MinHash:
+
+    def __init__(self, num_perm: Optional[int] = None, shingle_size: Optional[int] = None):
+        self.num_perm = num_perm or settings.MINHASH_NUM_PERM
+        self.shingle_size = shingle_size or settings.MINHASH_SHINGLE_SIZE
+        self.values = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+
+    def update(self, texts: Iterable[str]) -> None:
+        # Shingles are folded in fixed-size batches so a large document never
+        # materializes a (shingles x permutations) matrix.
+        batch = []
+        for text in texts:
+            words = WORD_RE.findall(text.lower())
+            size = min(self.shingle_size, len(words))
+            for i in range(len(words) - size + 1):
+                batch.append(_hash_shingle(" ".join(words[i:i + size])))
+                if len(batch) == SHINGLE_BATCH_SIZE:
+                    self._fold(batch)
+                    batch = []
+
+        if batch:
+            self._fold(batch)
+
+    def _fold(self, hashes: list[int]) -> None:
+        a, b = _permutations(self.num_perm)
+        hv = np.array(hashes, dtype=np.uint64)
+        permuted = np.bitwise_and((np.outer(hv, a) + b) % MERSENNE_PRIME, MAX_HASH)
+        np.minimum(self.values, permuted.min(axis=0), out=self.values)
+
+    def is_empty(self) -> bool:
+        return bool((self.values == MAX_HASH).all())
+
+    def digest(self) -> bytes:
+        return self.values.tobytes()
+
+    def band_hashes(self, bands: Optional[int] = None) -> list[int]:
+        bands = bands or settings.MINHASH_BANDS
+        rows = self.num_perm // bands
+        return [
+            int.from_bytes(
+                hashlib.blake2b(self.values[i * rows:(i + 1) * rows].tobytes(), digest_size=8).digest(),
+                "big",
+                signed=True,
+            )
+            for i in range(bands)
+        ]
+
+    def similarity(self, other_digest: bytes) -> float:
+        other = np.frombuffer(other_digest, dtype=np.uint64)
+        if other.shape != self.values.shape:
+            return 0.0
+        return float((self.values == other).mean())
+
+
+async def find_near_duplicate(
+    db: AsyncSession,
+    document_id: uuid.UUID,
+    minhash: MinHash,
+    threshold: Optional[float] = None,
+) -> Optional[tuple[uuid.UUID, float]]:
+    if minhash.is_empty():
+        return None
+
+    threshold = threshold or settings.NEAR_DUPLICATE_THRESHOLD
+    bands = list(enumerate(minhash.band_hashes()))
+
+    result = await db.execute(
+        select(DocumentSignature.document_id, DocumentSignature.minhash)
+        .join(Document, Document.id == DocumentSignature.document_id)
+        .where(
+            DocumentSignature.document_id.in_(
+                select(DocumentSignatureBand.document_id).where(
+                    tuple_(DocumentSignatureBand.band_index, DocumentSignatureBand.band_hash).in_(bands)
+                )
+            ),
+            DocumentSignature.document_id != document_id,
+            Document.deleted_at.is_(None),
+        )
+    )
+
+    best = None
+    for candidate_id, digest in result.all():
+        similarity = minhash.similarity(digest)
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (candidate_id, similarity)
+
+    return best
+
+
+async def save_signature(
+    db: AsyncSession,
+    document_id: uuid.UUID,
+    minhash: MinHash,
+    match: Optional[tuple[uuid.UUID, float]] = None,
+) -> None:
+    await db.execute(delete(DocumentSignatureBand).where(DocumentSignatureBand.document_id == document_id))
+    await db.execute(delete(DocumentSignature).where(DocumentSignature.document_id == document_id))
+
+    if minhash.is_empty():
+        return
+
+    db.add(DocumentSignature(
+        document_id=document_id,
+        minhash=minhash.digest(),
+        duplicate_of=match[0] if match else None,
+        similarity=match[1] if match else None,
+    ))
+    await db.flush()
+    await db.execute(
+        DocumentSignatureBand.__table__.insert(),
+        [
+            {"document_id": document_id, "band_index": i, "band_hash": band_hash}
+            for i, band_hash in enumerate(minhash.band_hashes())
+        ],
+    )
@@ -1,7 +1,17 @@
+import asyncio
+import bisect
+import codecs
 import hashlib
+import multiprocessing
 import os
+import uuid
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Optional, Protocol, Sequence
 
 import aiofiles
 import fitz
@@ -13,7 +23,56 @@ from app.config import get_settings
 settings = get_settings()
 
 ALLOWED_EXTENSIONS = {"pdf", "txt", "md", "docx"}
-MAX_FILE_SIZE = 10 * 1024 * 1024
+MAX_FILE_SIZE = settings.MAX_UPLOAD_SIZE
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+SEGMENT_SEPARATORS = {"pdf": "\n\n", "docx": "\n", "txt": "", "md": ""}
+CHUNK_STRATEGIES = ("characters", "tokens")
+# Upper bound on characters per token, used to turn a token budget into the
+# character spans the chunk locator and streaming window work with.
+MAX_CHARS_PER_TOKEN = 16
+
+
+@dataclass(frozen=True)
+class ChunkingPolicy:
+    strategy: str
+    chunk_size: int
+    chunk_overlap: int
+
+    @classmethod
+    def from_settings(
+        cls,
+        strategy: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+    ) -> "ChunkingPolicy":
+        strategy = strategy or settings.CHUNK_STRATEGY
+        if strategy not in CHUNK_STRATEGIES:
+            raise ValueError(f"Unknown chunk strategy: {strategy}")
+
+        if strategy == "tokens":
+            default_size, default_overlap = settings.CHUNK_TOKEN_SIZE, settings.CHUNK_TOKEN_OVERLAP
+        else:
+            default_size, default_overlap = settings.CHUNK_SIZE, settings.CHUNK_OVERLAP
+
+        if chunk_size is None:
+            chunk_size = default_size
+        chunk_overlap = chunk_overlap if chunk_overlap is not None else min(default_overlap, chunk_size // 2)
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be positive")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("Chunk overlap must be non-negative and smaller than the chunk size")
+
+        return cls(strategy, chunk_size, chunk_overlap)
+
+
+# Documents ingested before chunking policies were stored were all split this
+# way; replacing one must re-chunk identically for the chunk diff to work.
+LEGACY_CHUNKING = ChunkingPolicy("characters", 500, 50)
+
+
+class AsyncReadable(Protocol):
+    async def read(self, size: int = -1) -> bytes:
+        ...
 
 
 def get_file_extension(filename: str) -> str:
@@ -24,160 +83,345 @@ def is_allowed_file(filename: str) -> bool:
     return get_file_extension(filename) in ALLOWED_EXTENSIONS
 
 
-def compute_file_hash(content: bytes) -> str:
-    return hashlib.sha256(content).hexdigest()
+async def stream_to_file(
+    source: AsyncReadable,
+    file_path: str,
+    max_size: int = MAX_FILE_SIZE,
+    block_size: int = UPLOAD_BLOCK_SIZE,
+) -> tuple[str, int]:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(file_path, "wb") as f:
+            while True:
+                block = await source.read(block_size)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_size:
+                    raise ValueError(f"File too large. Max size: {max_size} bytes")
+                hasher.update(block)
+                await f.write(block)
+    except BaseException:
+        remove_file(file_path)
+        raise
+
+    return hasher.hexdigest(), size
+
+
+def copy_to_file(
+    source: BinaryIO,
+    file_path: str,
+    max_size: int = MAX_FILE_SIZE,
+    block_size: int = UPLOAD_BLOCK_SIZE,
+) -> tuple[str, int]:
+    # Blocking counterpart of stream_to_file, for use in a worker thread.
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                block = source.read(block_size)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_size:
+                    raise ValueError(f"File too large. Max size: {max_size} bytes")
+                hasher.update(block)
+                f.write(block)
+    except BaseException:
+        remove_file(file_path)
+        raise
 
+    return hasher.hexdigest(), size
 
-async def save_file(content: bytes, file_path: str) -> None:
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(content)
 
+def remove_file(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
 
-async def read_file(file_path: str) -> bytes:
-    async with aiofiles.open(file_path, "rb") as f:
-        return await f.read()
 
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> list[str]:
+    doc = fitz.open(file_path)
+    try:
+        return [doc[page_num].get_text() for page_num in range(start, end)]
+    finally:
+        doc.close()
 
-def extract_text_from_pdf(content: bytes) -> tuple[str, list[dict]]:
-    text_parts = []
-    pages = []
 
-    doc = fitz.open(stream=content, filetype="pdf")
-    for page_num, page in enumerate(doc):
-        page_text = page.get_text()
-        text_parts.append(page_text)
-        pages.append({
-            "page_number": page_num + 1,
-            "content": page_text,
-            "start_char": sum(len(p) for p in text_parts[:-1]),
-            "end_char": sum(len(p) for p in text_parts),
-        })
-    doc.close()
+def _pdf_page_ranges(page_count: int) -> list[tuple[int, int]]:
+    size = settings.PDF_PAGES_PER_TASK
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _pdf_worker_count() -> int:
+    return settings.PDF_EXTRACT_WORKERS or os.cpu_count() or 1
 
-    return "\n".join(text_parts), pages
 
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=_pdf_worker_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_executor
 
-def extract_text_from_docx(content: bytes) -> str:
-    import io
-    doc = DocxDocument(io.BytesIO(content))
-    return "\n".join(para.text for para in doc.paragraphs)
 
+def close_pdf_executor() -> None:
+    global _pdf_executor
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=True, cancel_futures=True)
+        _pdf_executor = None
 
-def extract_text_from_txt(content: bytes) -> str:
-    return content.decode("utf-8", errors="ignore")
 
+def iter_pdf_pages(file_path: str) -> Iterator[dict]:
+    doc = fitz.open(file_path)
+    page_count = doc.page_count
+    doc.close()
 
-def extract_text(content: bytes, file_type: str) -> tuple[str, Optional[list[dict]]]:
+    workers = _pdf_worker_count()
+    if workers <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+        doc = fitz.open(file_path)
+        try:
+            for page_num in range(page_count):
+                yield {"page_number": page_num + 1, "content": doc[page_num].get_text()}
+        finally:
+            doc.close()
+        return
+
+    # Keep a bounded number of page ranges in flight and yield them in order.
+    executor = get_pdf_executor()
+    ranges = iter(_pdf_page_ranges(page_count))
+    pending = deque()
+    for start, end in ranges:
+        pending.append((start, executor.submit(_extract_pdf_page_range, file_path, start, end)))
+        if len(pending) >= workers * 2:
+            break
+
+    while pending:
+        start, future = pending.popleft()
+        next_range = next(ranges, None)
+        if next_range:
+            pending.append((
+                next_range[0],
+                executor.submit(_extract_pdf_page_range, file_path, *next_range),
+            ))
+        for offset, page_text in enumerate(future.result()):
+            yield {"page_number": start + offset + 1, "content": page_text}
+
+
+def iter_txt_blocks(file_path: str, block_size: int = UPLOAD_BLOCK_SIZE) -> Iterator[dict]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    with open(file_path, "rb") as f:
+        while block := f.read(block_size):
+            text = decoder.decode(block)
+            if text:
+                yield {"page_number": None, "content": text}
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield {"page_number": None, "content": tail}
+
+
+def iter_segments(file_path: str, file_type: str) -> Iterator[dict]:
     if file_type == "pdf":
-        return extract_text_from_pdf(content)
+        return iter_pdf_pages(file_path)
     elif file_type == "docx":
-        return extract_text_from_docx(content), None
+        doc = DocxDocument(file_path)
+        return ({"page_number": None, "content": para.text} for para in doc.paragraphs)
     elif file_type in ("txt", "md"):
-        return extract_text_from_txt(content), None
+        return iter_txt_blocks(file_path)
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
 
 
-def chunk_text(
-    text: str,
-    chunk_size: int | None = None,
-    chunk_overlap: int | None = None,
-) -> list[dict]:
-    chunk_size = chunk_size or settings.CHUNK_SIZE
-    chunk_overlap = chunk_overlap or settings.CHUNK_OVERLAP
-
-    splitter = RecursiveCharacterTextSplitter(
+def _make_splitter(
+    chunk_size: int,
+    chunk_overlap: int,
+    length_function: Callable[[str], int] = len,
+) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         separators=settings.CHUNK_SEPARATORS,
-        length_function=len,
+        length_function=length_function,
     )
 
-    docs = splitter.create_documents([text])
-    chunks = []
 
+def _locate_chunks(
+    text: str,
+    pieces: Iterable[str],
+    chunk_size: int,
+) -> Iterator[tuple[str, int, int]]:
     current_pos = 0
-    for doc in docs:
-        chunk_content = doc.page_content.strip()
+    prev_end = 0
+    for piece in pieces:
+        chunk_content = piece.strip()
         if not chunk_content:
             continue
 
-        start_char = text.find(chunk_content, current_pos)
+        # The next chunk starts at or just after the previous chunk's overlap, so
+        # searching a bounded window finds the same first match as an open-ended
+        # find() without scanning the rest of the text.
+        window_end = max(current_pos, prev_end) + len(chunk_content) + chunk_size
+        start_char = text.find(chunk_content, current_pos, window_end)
+        if start_char == -1:
+            start_char = text.find(chunk_content, current_pos)
         if start_char == -1:
             start_char = current_pos
         end_char = start_char + len(chunk_content)
         current_pos = max(current_pos, start_char + 1)
+        prev_end = end_char
 
-        chunks.append({
-            "chunk_index": len(chunks),
-            "content": chunk_content,
-            "content_hash": hashlib.sha256(chunk_content.encode()).hexdigest(),
-            "start_char": start_char,
-            "end_char": end_char,
-        })
-
-    return chunks
+        yield chunk_content, start_char, end_char
 
 
-def chunk_text_with_pages(
-    pages: list[dict],
-    chunk_size: int | None = None,
-    chunk_overlap: int | None = None,
-) -> list[dict]:
-    chunk_size = chunk_size or settings.CHUNK_SIZE
-    chunk_overlap = chunk_overlap or settings.CHUNK_OVERLAP
+def _split_window(
+    buffer: str,
+    splitter: RecursiveCharacterTextSplitter,
+    chunk_size: int,
+    final: bool,
+) -> tuple[list[tuple[str, int, int]], int]:
+    located = list(_locate_chunks(buffer, splitter.split_text(buffer), chunk_size))
+    if final:
+        return located, len(buffer)
 
-    full_text = "\n\n".join(p["content"] for p in pages)
+    # Chunks ending in the last chunk_size characters could still change once
+    # more text arrives, so they are re-split with the next window.
+    cutoff = len(buffer) - chunk_size
+    ready = 0
+    while ready < len(located) and located[ready][2] <= cutoff:
+        ready += 1
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=settings.CHUNK_SEPARATORS,
-        length_function=len,
-    )
+    restart = located[ready][1] if ready < len(located) else len(buffer)
+    return located[:ready], restart
 
-    docs = splitter.create_documents([full_text])
-    chunks = []
 
-    page_offsets = []
-    offset = 0
-    for page in pages:
-        page_offsets.append({
-            "page_number": page["page_number"],
-            "start": offset,
-            "end": offset + len(page["content"]),
-        })
-        offset += len(page["content"]) + 2
+def iter_chunks(
+    segments: Iterable[dict],
+    separator: str = "",
+    chunk_size: int | None = None,
+    chunk_overlap: int | None = None,
+    window: int | None = None,
+    length_function: Callable[[str], int] | None = None,
+) -> Iterator[dict]:
+    if chunk_size is None:
+        chunk_size = settings.CHUNK_SIZE
+    if chunk_overlap is None:
+        chunk_overlap = settings.CHUNK_OVERLAP
+
+    splitter = _make_splitter(chunk_size, chunk_overlap, length_function or len)
+    # With a token length function chunk_size is a token budget; span is the
+    # most characters such a chunk can cover.
+    span = chunk_size if length_function is None else chunk_size * MAX_CHARS_PER_TOKEN
+    window = max(window or settings.CHUNK_STREAM_WINDOW, span * 2)
+
+    parts: list[str] = []
+    buffered = 0
+    buffer_start = 0
+    text_len = 0
+    page_starts: list[int] = []
+    page_ends: list[int] = []
+    page_numbers: list[int] = []
+    chunk_index = 0
+
+    def to_chunks(located: list[tuple[str, int, int]]) -> Iterator[dict]:
+        nonlocal chunk_index
+        for chunk_content, start, end in located:
+            chunk = {
+                "chunk_index": chunk_index,
+                "content": chunk_content,
+                "content_hash": hashlib.sha256(chunk_content.encode()).hexdigest(),
+                "start_char": buffer_start + start,
+                "end_char": buffer_start + end,
+            }
+            if page_starts:
+                start_char = chunk["start_char"]
+                page_number = None
+                idx = bisect.bisect_right(page_starts, start_char) - 1
+                if idx >= 0 and start_char < page_ends[idx]:
+                    page_number = page_numbers[idx]
+                chunk["page_number"] = page_number
+            chunk_index += 1
+            yield chunk
+
+    for i, segment in enumerate(segments):
+        content = segment["content"]
+        if i > 0 and separator:
+            parts.append(separator)
+            text_len += len(separator)
+            buffered += len(separator)
+
+        if segment.get("page_number") is not None:
+            page_starts.append(text_len)
+            page_ends.append(text_len + len(content))
+            page_numbers.append(segment["page_number"])
+
+        parts.append(content)
+        text_len += len(content)
+        buffered += len(content)
+
+        if buffered >= window:
+            buffer = "".join(parts)
+            located, restart = _split_window(buffer, splitter, span, final=False)
+            yield from to_chunks(located)
+            parts = [buffer[restart:]]
+            buffered = len(parts[0])
+            buffer_start += restart
+
+    located, _ = _split_window("".join(parts), splitter, span, final=True)
+    yield from to_chunks(located)
+
+
+def diff_chunks(
+    existing: Sequence[Any],
+    chunks: list[dict],
+) -> tuple[list[tuple[Any, dict]], list[dict], list[Any]]:
+    by_hash: dict[str, list[Any]] = {}
+    for row in sorted(existing, key=lambda r: r.chunk_index):
+        by_hash.setdefault(row.content_hash, []).append(row)
+
+    kept = []
+    added = []
+    for chunk in chunks:
+        rows = by_hash.get(chunk["content_hash"])
+        if rows:
+            kept.append((rows.pop(0), chunk))
+        else:
+            added.append(chunk)
 
-    current_pos = 0
-    for doc in docs:
-        chunk_content = doc.page_content.strip()
-        if not chunk_content:
-            continue
+    removed = [row for rows in by_hash.values() for row in rows]
+    return kept, added, removed
 
-        start_char = full_text.find(chunk_content, current_pos)
-        if start_char == -1:
-            start_char = current_pos
-        end_char = start_char + len(chunk_content)
-        current_pos = max(current_pos, start_char + 1)
 
-        page_number = None
-        for po in page_offsets:
-            if po["start"] <= start_char < po["end"]:
-                page_number = po["page_number"]
-                break
+def parent_span(start_char: int, end_char: int, parent_size: int) -> tuple[int, int]:
+    pad = max(parent_size - (end_char - start_char), 0) // 2
+    return max(start_char - pad, 0), end_char + pad
 
-        chunks.append({
-            "chunk_index": len(chunks),
-            "content": chunk_content,
-            "content_hash": hashlib.sha256(chunk_content.encode()).hexdigest(),
-            "start_char": start_char,
-            "end_char": end_char,
-            "page_number": page_number,
-        })
 
-    return chunks
+def stitch_chunks(chunks: Iterable[tuple[int, int, str]]) -> str:
+    # Chunks are (start_char, end_char, content) in document order; overlapping
+    # text is emitted once and gaps were whitespace in the source.
+    parts: list[str] = []
+    covered: Optional[int] = None
+    for start, end, content in chunks:
+        if covered is None or start >= covered:
+            if parts:
+                parts.append("\n")
+            parts.append(content)
+        elif end > covered:
+            parts.append(content[covered - start:])
+        covered = end if covered is None else max(covered, end)
+    return "".join(parts)
 
 
 class DocumentProcessor:
@@ -185,53 +429,152 @@ class DocumentProcessor:
     def __init__(self, storage_dir: str = "data/documents"):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Temp files live under storage_dir so the final move is a same-filesystem rename.
+        self.tmp_dir = self.storage_dir / ".tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
 
     def get_storage_path(self, doc_id: str, file_type: str) -> str:
         return str(self.storage_dir / f"{doc_id}.{file_type}")
 
-    async def process_upload(
-        self,
-        filename: str,
-        content: bytes,
-    ) -> dict:
+    def _new_upload(self, filename: str, size_hint: Optional[int]) -> tuple[str, str]:
         file_type = get_file_extension(filename)
 
         if not is_allowed_file(filename):
             raise ValueError(f"File type not allowed: {file_type}")
 
-        if len(content) > MAX_FILE_SIZE:
+        if size_hint is not None and size_hint > MAX_FILE_SIZE:
             raise ValueError(f"File too large. Max size: {MAX_FILE_SIZE} bytes")
 
-        file_hash = compute_file_hash(content)
+        return file_type, str(self.tmp_dir / f"{uuid.uuid4()}.{file_type}")
+
+    async def process_upload(
+        self,
+        filename: str,
+        source: AsyncReadable,
+        size_hint: Optional[int] = None,
+    ) -> dict:
+        file_type, temp_path = self._new_upload(filename, size_hint)
+        file_hash, file_size = await stream_to_file(source, temp_path)
 
         return {
             "filename": filename,
             "file_type": file_type,
-            "file_size_bytes": len(content),
+            "file_size_bytes": file_size,
             "file_hash": file_hash,
-            "content": content,
+            "temp_path": temp_path,
         }
 
-    async def save_document(self, doc_id: str, file_type: str, content: bytes) -> str:
+    async def save_document(self, doc_id: str, file_type: str, temp_path: str) -> str:
         storage_path = self.get_storage_path(doc_id, file_type)
-        await save_file(content, storage_path)
+        os.replace(temp_path, storage_path)
         return storage_path
 
+    def stash_file(self, file_path: str) -> Optional[str]:
+        # Moves a stored file aside until a replace commits; None if it is gone.
+        stash_path = str(self.tmp_dir / f"{uuid.uuid4()}{Path(file_path).suffix}")
+        try:
+            os.replace(file_path, stash_path)
+        except FileNotFoundError:
+            return None
+        return stash_path
+
+    def restore_file(self, stash_path: str, file_path: str) -> None:
+        os.replace(stash_path, file_path)
+
+    def discard_upload(self, temp_path: str) -> None:
+        remove_file(temp_path)
+
+    def discard_entries(self, entries: list[dict]) -> None:
+        # Entries already moved into storage are gone from their temp path.
+        for entry in entries:
+            if "temp_path" in entry:
+                remove_file(entry["temp_path"])
+
+    async def process_archive(
+        self,
+        source: AsyncReadable,
+        max_entries: int,
+    ) -> list[dict]:
+        archive_path = str(self.tmp_dir / f"{uuid.uuid4()}.zip")
+        await stream_to_file(source, archive_path, max_size=settings.MAX_ARCHIVE_SIZE)
+
+        try:
+            # zipfile reads and inflates synchronously.
+            return await asyncio.to_thread(self._extract_archive, archive_path, max_entries)
+        finally:
+            remove_file(archive_path)
+
+    def _extract_archive(self, archive_path: str, max_entries: int) -> list[dict]:
+        entries = []
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+
+                    filename = os.path.basename(info.filename)
+                    if filename.startswith(".") or info.filename.startswith("__MACOSX/"):
+                        continue
+
+                    if len(entries) >= max_entries:
+                        entries.append({"filename": filename, "error": "Too many files in upload"})
+                        continue
+
+                    try:
+                        file_type, temp_path = self._new_upload(filename, info.file_size)
+                        with archive.open(info) as f:
+                            file_hash, file_size = copy_to_file(f, temp_path)
+                        entries.append({
+                            "filename": filename,
+                            "file_type": file_type,
+                            "file_size_bytes": file_size,
+                            "file_hash": file_hash,
+                            "temp_path": temp_path,
+                        })
+                    except ValueError as e:
+                        entries.append({"filename": filename, "error": str(e)})
+                    except NotImplementedError:
+                        entries.append({"filename": filename, "error": "Unsupported compression method"})
+                    except RuntimeError:
+                        # zipfile's error for encrypted entries; NotImplementedError
+                        # subclasses it, hence the order.
+                        entries.append({"filename": filename, "error": "Encrypted files are not supported"})
+                    except (zipfile.BadZipFile, zlib.error, EOFError):
+                        entries.append({"filename": filename, "error": "Corrupt archive entry"})
+        except zipfile.BadZipFile:
+            self.discard_entries(entries)
+            raise ValueError("Invalid zip archive")
+        except BaseException:
+            self.discard_entries(entries)
+            raise
+
+        return entries
+
+    def iter_chunks(
+        self,
+        file_path: str,
+        file_type: str,
+        chunk_size: int | None = None,
+        chunk_overlap: int | None = None,
+        length_function: Callable[[str], int] | None = None,
+    ) -> Iterator[dict]:
+        return iter_chunks(
+            iter_segments(file_path, file_type),
+            SEGMENT_SEPARATORS.get(file_type, ""),
+            chunk_size,
+            chunk_overlap,
+            length_function=length_function,
+        )
+
     def extract_and_chunk(
         self,
-        content: bytes,
+        file_path: str,
         file_type: str,
         chunk_size: int | None = None,
         chunk_overlap: int | None = None,
+        length_function: Callable[[str], int] | None = None,
     ) -> list[dict]:
-        text, pages = extract_text(content, file_type)
-
-        if pages:
-            chunks = chunk_text_with_pages(pages, chunk_size, chunk_overlap)
-        else:
-            chunks = chunk_text(text, chunk_size, chunk_overlap)
-
-        return chunks
+        return list(self.iter_chunks(file_path, file_type, chunk_size, chunk_overlap, length_function))
 
 
 _document_processor: Optional[DocumentProcessor] = None
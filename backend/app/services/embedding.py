@@ -1,11 +1,24 @@
+import asyncio
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from typing import Optional
 
 import httpx
+import tiktoken
 from sentence_transformers import SentenceTransformer
 
 from app.config import Settings, get_settings
 
+TOKEN_COUNT_CACHE_SIZE = 65536
+# Only strings up to this length are memoized, which bounds the cache to a
+# few MB; longer ones are chunk or window texts that rarely repeat.
+TOKEN_COUNT_CACHE_MAX_CHARS = 64
+
+
+@lru_cache
+def get_encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
 
 class BaseEmbedder(ABC):
     @abstractmethod
@@ -29,6 +42,15 @@ class BaseEmbedder(ABC):
     def dimension(self) -> int:
         pass
 
+    def count_tokens(self, text: str) -> int:
+        # Providers without a published tokenizer are approximated with
+        # cl100k_base, which is close enough for sizing chunks.
+        return len(get_encoding("cl100k_base").encode(text, disallowed_special=()))
+
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        return None
+
 
 class OllamaEmbedder(BaseEmbedder):
     def __init__(self, base_url: str, model: str):
@@ -88,6 +110,9 @@ class OpenAIEmbedder(BaseEmbedder):
         response.raise_for_status()
         return response.json()["data"][0]["embedding"]
 
+    def count_tokens(self, text: str) -> int:
+        return len(tiktoken.encoding_for_model(self.model).encode(text, disallowed_special=()))
+
     async def embed_batch(self, texts: list[str]) -> list[list[float]]:
         response = await self.client.post(
             "/embeddings",
@@ -107,6 +132,10 @@ class OpenAIEmbedder(BaseEmbedder):
     def dimension(self) -> int:
         return self.DIMENSIONS.get(self.model, 1536)
 
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        return 8191
+
 
 class GeminiEmbedder(BaseEmbedder):
     def __init__(self, api_key: str, model: str = "text-embedding-004"):
@@ -158,12 +187,14 @@ class LocalEmbedder(BaseEmbedder):
 
     async def embed(self, text: str) -> list[float]:
         model = self._load_model()
-        embedding = model.encode(text, convert_to_numpy=True)
+        # Encoding is CPU-bound; running it off the event loop lets the other
+        # retrieval stages of a turn proceed meanwhile.
+        embedding = await asyncio.to_thread(model.encode, text, convert_to_numpy=True)
         return embedding.tolist()
 
     async def embed_batch(self, texts: list[str]) -> list[list[float]]:
         model = self._load_model()
-        embeddings = model.encode(texts, convert_to_numpy=True)
+        embeddings = await asyncio.to_thread(model.encode, texts, convert_to_numpy=True)
         return embeddings.tolist()
 
     async def warmup(self) -> None:
@@ -172,16 +203,26 @@ class LocalEmbedder(BaseEmbedder):
     async def close(self) -> None:
         self._model = None
 
+    def count_tokens(self, text: str) -> int:
+        tokenizer = self._load_model().tokenizer
+        return len(tokenizer.encode(text, add_special_tokens=False, verbose=False))
+
     @property
     def dimension(self) -> int:
         return self.DIMENSIONS.get(self.model_name, 768)
 
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        # max_seq_length includes the special tokens added around each input.
+        return self._load_model().max_seq_length - 2
+
 
 class EmbeddingService:
     def __init__(self, settings: Optional[Settings] = None):
         self.settings = settings or get_settings()
         self.embedder: Optional[BaseEmbedder] = None
         self._initialized = False
+        self._count_tokens = None
 
     async def initialize(self) -> None:
         if self._initialized:
@@ -212,6 +253,9 @@ class EmbeddingService:
             raise ValueError(f"Unknown embedding provider: {provider}")
 
         await self.embedder.warmup()
+        # The text splitter measures the same words and separators over and
+        # over, so token counts for short strings are memoized.
+        self._count_tokens = lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)(self.embedder.count_tokens)
         self._initialized = True
 
     async def embed(self, text: str) -> list[float]:
@@ -230,6 +274,19 @@ class EmbeddingService:
             raise RuntimeError("EmbeddingService not initialized")
         return self.embedder.dimension
 
+    def count_tokens(self, text: str) -> int:
+        if self._count_tokens is None:
+            raise RuntimeError("EmbeddingService not initialized")
+        if len(text) > TOKEN_COUNT_CACHE_MAX_CHARS:
+            return self.embedder.count_tokens(text)
+        return self._count_tokens(text)
+
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        if self.embedder is None:
+            raise RuntimeError("EmbeddingService not initialized")
+        return self.embedder.max_input_tokens
+
     async def close(self) -> None:
         if self.embedder:
             await self.embedder.close()
@@ -0,0 +1,325 @@
+import asyncio
+import itertools
+import json
+import logging
+import uuid
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings, get_settings
+from app.db import get_db_session
+from app.db.postgres import Document, DocumentChunk, DocumentChunkingPolicy
+from app.db.redis import RedisCache, get_redis
+from app.services.answer_cache import bump_corpus_version
+from app.services.dedup import MinHash, NearDuplicateError, find_near_duplicate, save_signature
+from app.services.document import ChunkingPolicy, get_document_processor, remove_file
+from app.services.embedding import get_embedding_service
+from app.services.qdrant import get_qdrant_service
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY_PREFIX = "ingest_job:"
+JOB_TTL = 24 * 3600
+
+
+async def insert_chunks(
+    db: AsyncSession,
+    document_id: uuid.UUID,
+    chunks: list[dict],
+    vector_ids: list[str],
+) -> None:
+    if not chunks:
+        return
+
+    await db.execute(
+        insert(DocumentChunk),
+        [
+            {
+                "id": uuid.uuid4(),
+                "document_id": document_id,
+                "chunk_index": chunk["chunk_index"],
+                "content": chunk["content"],
+                "content_hash": chunk["content_hash"],
+                "vector_id": vector_id,
+                "start_char": chunk.get("start_char"),
+                "end_char": chunk.get("end_char"),
+                "page_number": chunk.get("page_number"),
+                "created_at": datetime.utcnow(),
+            }
+            for chunk, vector_id in zip(chunks, vector_ids)
+        ],
+    )
+
+
+async def get_chunking_policy(
+    db: AsyncSession,
+    document_id: uuid.UUID,
+    default: ChunkingPolicy,
+) -> ChunkingPolicy:
+    row = await db.get(DocumentChunkingPolicy, document_id)
+    if row is None:
+        return default
+    return ChunkingPolicy(row.strategy, row.chunk_size, row.chunk_overlap)
+
+
+def save_chunking_policy(db: AsyncSession, document_id: uuid.UUID, policy: ChunkingPolicy) -> None:
+    db.add(DocumentChunkingPolicy(
+        document_id=document_id,
+        strategy=policy.strategy,
+        chunk_size=policy.chunk_size,
+        chunk_overlap=policy.chunk_overlap,
+    ))
+
+
+async def resolve_chunking(
+    policy: ChunkingPolicy,
+) -> tuple[ChunkingPolicy, Optional[Callable[[str], int]]]:
+    if policy.strategy != "tokens":
+        return policy, None
+
+    embedding_service = get_embedding_service()
+    await embedding_service.initialize()
+
+    # Text past the model's input limit is silently truncated when embedded,
+    # so token budgets are capped to it.
+    limit = embedding_service.max_input_tokens
+    if limit and policy.chunk_size > limit:
+        policy = replace(
+            policy,
+            chunk_size=limit,
+            chunk_overlap=min(policy.chunk_overlap, limit // 2),
+        )
+    return policy, embedding_service.count_tokens
+
+
+@dataclass
+class IngestResult:
+    chunks_count: int
+    duplicate_of: Optional[uuid.UUID] = None
+    similarity: Optional[float] = None
+
+
+def _take(chunks: Iterator[dict], count: int, minhash: Optional[MinHash] = None) -> list[dict]:
+    batch = list(itertools.islice(chunks, count))
+    if minhash is not None:
+        minhash.update(chunk["content"] for chunk in batch)
+    return batch
+
+
+def _compute_minhash(chunks: Iterator[dict], batch_size: int) -> MinHash:
+    minhash = MinHash()
+    while _take(chunks, batch_size, minhash):
+        pass
+    return minhash
+
+
+class IngestionPipeline:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.processor = get_document_processor()
+        self.qdrant = get_qdrant_service()
+        self._document_slots = asyncio.Semaphore(self.settings.INGEST_DOCUMENT_CONCURRENCY)
+        self._extract_slots = asyncio.Semaphore(self.settings.INGEST_EXTRACT_CONCURRENCY)
+        self._embed_slots = asyncio.Semaphore(self.settings.INGEST_EMBED_CONCURRENCY)
+        self._write_slots = asyncio.Semaphore(self.settings.INGEST_WRITE_CONCURRENCY)
+
+    async def _cache(self) -> RedisCache:
+        return RedisCache(await get_redis())
+
+    def new_job(self, results: list[dict]) -> dict:
+        return {
+            "job_id": str(uuid.uuid4()),
+            "status": "processing",
+            "total": len(results),
+            "processed": sum(1 for r in results if r["status"] != "queued"),
+            "results": results,
+        }
+
+    async def save_job(self, job: dict) -> None:
+        cache = await self._cache()
+        await cache.set(f"{JOB_KEY_PREFIX}{job['job_id']}", json.dumps(job), expire=JOB_TTL)
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        cache = await self._cache()
+        data = await cache.get(f"{JOB_KEY_PREFIX}{job_id}")
+        return json.loads(data) if data else None
+
+    async def run_job(self, job: dict, items: list[dict]) -> None:
+        await asyncio.gather(*(self._ingest(job, item) for item in items))
+        job["status"] = "completed"
+        await self.save_job(job)
+        logger.info(f"Ingestion job {job['job_id']} completed: {len(items)} documents")
+
+    async def ingest(
+        self,
+        db: AsyncSession,
+        document: Document,
+        policy: Optional[ChunkingPolicy] = None,
+    ) -> IngestResult:
+        if policy is None:
+            policy = await get_chunking_policy(db, document.id, ChunkingPolicy.from_settings())
+        policy, length_function = await resolve_chunking(policy)
+
+        document_id = document.id
+        owner_id = str(document.owner_id) if document.owner_id else None
+        visibility = document.visibility
+        batch_size = self.settings.INGEST_BATCH_SIZE
+        duplicate_action = self.settings.NEAR_DUPLICATE_ACTION
+
+        match = None
+        minhash = None
+        if duplicate_action == "skip":
+            # Check before embedding anything so a skipped document costs only
+            # one extraction pass.
+            minhash = await asyncio.to_thread(
+                _compute_minhash,
+                self.processor.iter_chunks(
+                    document.storage_path,
+                    document.file_type,
+                    policy.chunk_size,
+                    policy.chunk_overlap,
+                    length_function,
+                ),
+                batch_size,
+            )
+            match = await find_near_duplicate(db, document_id, minhash)
+            if match:
+                raise NearDuplicateError(*match)
+        elif duplicate_action == "flag":
+            minhash = MinHash()
+
+        chunks = self.processor.iter_chunks(
+            document.storage_path,
+            document.file_type,
+            policy.chunk_size,
+            policy.chunk_overlap,
+            length_function,
+        )
+        streaming_minhash = minhash if duplicate_action == "flag" else None
+
+        total = 0
+        try:
+            while True:
+                async with self._extract_slots:
+                    batch = await asyncio.to_thread(_take, chunks, batch_size, streaming_minhash)
+                if not batch:
+                    break
+
+                async with self._embed_slots:
+                    embeddings = await self.qdrant.embed_chunks(batch)
+
+                async with self._write_slots:
+                    vector_ids = await asyncio.to_thread(
+                        self.qdrant.upsert_chunks,
+                        document_id=str(document_id),
+                        chunks=batch,
+                        embeddings=embeddings,
+                        visibility=visibility,
+                        owner_id=owner_id,
+                    )
+                    # Committed per batch so no transaction stays open across
+                    # embedding calls; the document isn't ready until the end.
+                    await insert_chunks(db, document_id, batch, vector_ids)
+                    await db.commit()
+
+                total += len(batch)
+
+            if minhash is not None:
+                if duplicate_action == "flag":
+                    match = await find_near_duplicate(db, document_id, minhash)
+                    if match:
+                        logger.info(
+                            f"Document {document_id} flagged as near-duplicate of "
+                            f"{match[0]} (similarity {match[1]:.2f})"
+                        )
+                await save_signature(db, document_id, minhash, match)
+
+            document.status = "ready"
+            document.chunks_count = total
+            document.processed_at = datetime.utcnow()
+            await db.commit()
+            await bump_corpus_version()
+        except Exception:
+            await db.rollback()
+            # The document had no chunks or vectors before ingestion started, so
+            # removing everything under its id also covers batches already
+            # written.
+            await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+            await db.commit()
+            await asyncio.to_thread(self.qdrant.delete_by_document, str(document_id))
+            raise
+
+        return IngestResult(
+            chunks_count=total,
+            duplicate_of=match[0] if match else None,
+            similarity=match[1] if match else None,
+        )
+
+    async def discard(self, db: AsyncSession, document: Document) -> None:
+        storage_path = document.storage_path
+        await db.delete(document)
+        await db.commit()
+        remove_file(storage_path)
+
+    async def _ingest(self, job: dict, item: dict) -> None:
+        # Taken before the session, so documents waiting for a slot don't sit
+        # on pooled connections.
+        async with self._document_slots:
+            await self._ingest_item(job, item)
+
+        job["processed"] += 1
+        await self.save_job(job)
+
+    async def _ingest_item(self, job: dict, item: dict) -> None:
+        result = job["results"][item["result_index"]]
+        document_id = item["document_id"]
+
+        try:
+            async with get_db_session() as db:
+                document = await db.get(Document, document_id)
+                try:
+                    ingested = await self.ingest(db, document)
+                except NearDuplicateError as e:
+                    await self.discard(db, document)
+                    result["status"] = "duplicate"
+                    result["document_id"] = None
+                    result["message"] = str(e)
+                else:
+                    result["status"] = "ready"
+                    result["chunks_count"] = ingested.chunks_count
+                    if ingested.duplicate_of:
+                        result["message"] = (
+                            f"Near-duplicate of document {ingested.duplicate_of} "
+                            f"(similarity {ingested.similarity:.2f})"
+                        )
+        except Exception as e:
+            logger.warning(f"Ingestion failed for document {document_id}: {e}")
+            await self._mark_failed(document_id, str(e))
+            result["status"] = "failed"
+            result["message"] = str(e)
+
+    async def _mark_failed(self, document_id: uuid.UUID, error: str) -> None:
+        try:
+            async with get_db_session() as db:
+                document = await db.get(Document, document_id)
+                if document:
+                    document.status = "failed"
+                    document.error_message = error
+                    await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to mark document {document_id} as failed: {e}")
+
+
+_ingestion_pipeline: Optional[IngestionPipeline] = None
+
+
+def get_ingestion_pipeline() -> IngestionPipeline:
+    global _ingestion_pipeline
+    if _ingestion_pipeline is None:
+        _ingestion_pipeline = IngestionPipeline()
+    return _ingestion_pipeline
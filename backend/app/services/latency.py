@@ -0,0 +1,127 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.postgres import TurnTiming
+
+STAGES = (
+    "embedding",
+    "documents",
+    "memory",
+    "history",
+    "web_search",
+    "prompt",
+    "first_token",
+    "generation",
+    "persist",
+    "total",
+)
+PERCENTILES = (50, 95, 99)
+
+
+class TurnTimer:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.model_name: Optional[str] = None
+        self.context_source: Optional[str] = None
+        self.cache_hit = False
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self) -> None:
+        self.stages["total"] = time.perf_counter() - self.started
+
+    def _ms(self, name: str) -> Optional[int]:
+        seconds = self.stages.get(name)
+        return round(seconds * 1000) if seconds is not None else None
+
+    def as_dict(self) -> dict:
+        return {
+            "stages_ms": {name: self._ms(name) for name in STAGES if name in self.stages},
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit": self.cache_hit,
+        }
+
+    def to_row(self, session_id: str) -> TurnTiming:
+        return TurnTiming(
+            session_id=session_id,
+            model_name=self.model_name,
+            context_source=self.context_source or "none",
+            cache_hit=self.cache_hit,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            **{f"{name}_ms": self._ms(name) for name in STAGES},
+        )
+
+
+def _percentile_columns() -> list:
+    # percentile_cont skips NULLs, so stages that didn't run in a turn don't
+    # drag the percentiles towards zero.
+    return [
+        func.percentile_cont(p / 100).within_group(getattr(TurnTiming, f"{name}_ms")).label(f"{name}_p{p}")
+        for name in STAGES
+        for p in PERCENTILES
+    ]
+
+
+def _stage_percentiles(row) -> dict:
+    stages = {}
+    for name in STAGES:
+        values = {f"p{p}": getattr(row, f"{name}_p{p}") for p in PERCENTILES}
+        if values["p50"] is not None:
+            stages[name] = {k: round(v, 1) for k, v in values.items()}
+    return stages
+
+
+async def get_latency_analytics(db: AsyncSession, days: int) -> dict:
+    since = datetime.utcnow() - timedelta(days=days)
+    turns = func.count(TurnTiming.id).label("turns")
+    hits = func.count(TurnTiming.id).filter(TurnTiming.cache_hit.is_(True)).label("cache_hits")
+
+    result = await db.execute(
+        select(turns, hits, *_percentile_columns()).where(TurnTiming.created_at >= since)
+    )
+    overall = result.one()
+
+    breakdowns = {}
+    for key, column in (("by_model", TurnTiming.model_name), ("by_source", TurnTiming.context_source)):
+        result = await db.execute(
+            select(column.label("group"), turns, hits, *_percentile_columns())
+            .where(TurnTiming.created_at >= since)
+            .group_by(column)
+            .order_by(turns.desc())
+        )
+        breakdowns[key] = {
+            row.group or "unknown": {
+                "turns": row.turns,
+                "cache_hits": row.cache_hits,
+                "stages": _stage_percentiles(row),
+            }
+            for row in result.all()
+        }
+
+    return {
+        "period_days": days,
+        "turns": overall.turns,
+        "cache_hits": overall.cache_hits,
+        "stages": _stage_percentiles(overall) if overall.turns else {},
+        **breakdowns,
+    }
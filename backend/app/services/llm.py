@@ -1,6 +1,7 @@
 import logging
 import re
 import uuid
+from contextlib import aclosing
 from typing import Optional, AsyncIterator
 from dataclasses import dataclass
 
@@ -242,15 +243,21 @@ class LLMService:
 
         raise ValueError("No active LLM models configured")
 
+    async def resolve_model_config(
+        self,
+        db: AsyncSession,
+        model_id: Optional[uuid.UUID] = None,
+    ) -> tuple[LLMModel, LLMProvider]:
+        if model_id:
+            return await self.get_model_config(db, model_id)
+        return await self.get_default_model_config(db)
+
     async def get_client(
         self,
         db: AsyncSession,
         model_id: Optional[uuid.UUID] = None,
     ) -> tuple[BaseChatModel, str, str]:
-        if model_id:
-            model, provider = await self.get_model_config(db, model_id)
-        else:
-            model, provider = await self.get_default_model_config(db)
+        model, provider = await self.resolve_model_config(db, model_id)
 
         cache_key = f"{provider.id}:{model.id}"
 
@@ -294,14 +301,18 @@ class LLMService:
     ) -> AsyncIterator[str]:
         client, provider_type, model_name = await self.get_client(db, model_id)
 
+        # Closing this generator early (a cancelled turn) closes the provider
+        # stream with it, so the model stops generating for nobody.
         try:
             if provider_type == "ollama":
-                async for chunk in self._stream_ollama(db, messages, model_id):
-                    yield chunk
+                async with aclosing(self._stream_ollama(db, messages, model_id)) as stream:
+                    async for chunk in stream:
+                        yield chunk
             else:
-                async for chunk in client.astream(messages):
-                    if chunk.content:
-                        yield chunk.content
+                async with aclosing(client.astream(messages)) as stream:
+                    async for chunk in stream:
+                        if chunk.content:
+                            yield chunk.content
         except Exception as e:
             parsed_error = parse_llm_error(provider_type, e)
             logger.error(
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import uuid
 from typing import Optional
@@ -5,9 +6,7 @@ from datetime import datetime
 
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
-    Distance,
     PointStruct,
-    VectorParams,
     Filter,
     FieldCondition,
     MatchValue,
@@ -15,10 +14,12 @@ from qdrant_client.models import (
 
 from app.config import Settings, get_settings
 from app.services.embedding import get_embedding_service
+from app.services.qdrant import ensure_alias, resolve_alias
 
 logger = logging.getLogger(__name__)
 
 MEMORY_COLLECTION = "user_memories"
+MEMORY_ALIAS = "user_memories_current"
 
 
 class MemoryService:
@@ -31,6 +32,9 @@ class MemoryService:
         )
         self.embedding_service = get_embedding_service()
         self._collection_ensured = False
+        # Collections a re-index is copying memories into, with the deletes
+        # made meanwhile; see _delete.
+        self._mirrors: dict[str, list] = {}
 
     async def _ensure_collection(self) -> None:
         if self._collection_ensured:
@@ -39,20 +43,14 @@ class MemoryService:
         if not self.embedding_service._initialized:
             await self.embedding_service.initialize()
 
-        collections = self.client.get_collections().collections
-        collection_names = [c.name for c in collections]
-
-        if MEMORY_COLLECTION not in collection_names:
-            self.client.create_collection(
-                collection_name=MEMORY_COLLECTION,
-                vectors_config=VectorParams(
-                    size=self.embedding_service.dimension,
-                    distance=Distance.COSINE,
-                ),
-            )
-
+        ensure_alias(self.client, MEMORY_ALIAS, MEMORY_COLLECTION, self.embedding_service.dimension)
         self._collection_ensured = True
 
+    def _collection(self) -> str:
+        if self._collection_ensured:
+            return MEMORY_ALIAS
+        return resolve_alias(self.client, MEMORY_ALIAS) or MEMORY_COLLECTION
+
     async def add_conversation(
         self,
         messages: list[dict],
@@ -85,7 +83,7 @@ class MemoryService:
             },
         )
 
-        self.client.upsert(collection_name=MEMORY_COLLECTION, points=[point])
+        self.client.upsert(collection_name=MEMORY_ALIAS, points=[point])
         logger.info(f"Memory added for user {user_id}: {memory_id}")
 
         return {"id": memory_id, "status": "added"}
@@ -95,10 +93,12 @@ class MemoryService:
         query: str,
         user_id: Optional[str] = None,
         limit: int = 5,
+        query_vector: Optional[list[float]] = None,
     ) -> list[dict]:
         await self._ensure_collection()
 
-        query_vector = await self.embedding_service.embed(query)
+        if query_vector is None:
+            query_vector = await self.embedding_service.embed(query)
 
         filter_conditions = []
         if user_id:
@@ -106,12 +106,13 @@ class MemoryService:
                 FieldCondition(key="user_id", match=MatchValue(value=user_id))
             )
 
-        results = self.client.query_points(
-            collection_name=MEMORY_COLLECTION,
+        results = (await asyncio.to_thread(
+            self.client.query_points,
+            collection_name=MEMORY_ALIAS,
             query=query_vector,
             query_filter=Filter(must=filter_conditions) if filter_conditions else None,
             limit=limit,
-        ).points
+        )).points
 
         return [
             {
@@ -132,13 +133,14 @@ class MemoryService:
                 FieldCondition(key="user_id", match=MatchValue(value=user_id))
             )
 
-        results = self.client.scroll(
-            collection_name=MEMORY_COLLECTION,
+        results = (await asyncio.to_thread(
+            self.client.scroll,
+            collection_name=MEMORY_ALIAS,
             scroll_filter=Filter(must=filter_conditions) if filter_conditions else None,
             limit=limit,
             with_payload=True,
             with_vectors=False,
-        )[0]
+        ))[0]
 
         return [
             {
@@ -149,38 +151,67 @@ class MemoryService:
             for point in results
         ]
 
+    def start_mirroring(self, collection_name: str) -> None:
+        self._mirrors.setdefault(collection_name, [])
+
+    def stop_mirroring(self, collection_name: str) -> None:
+        self._mirrors.pop(collection_name, None)
+
+    def replay_deletes(self, collection_name: str) -> None:
+        # A delete can land between a re-index reading a memory and writing
+        # its copy; replaying removes any copy that slipped through.
+        for selector in self._mirrors.get(collection_name, []):
+            self.client.delete(collection_name=collection_name, points_selector=selector)
+
+    def _delete(self, selector) -> None:
+        # While a re-index runs, the alias still points at the old collection;
+        # a delete applied only there would come back with the swap.
+        self.client.delete(collection_name=self._collection(), points_selector=selector)
+        for collection_name, deletes in self._mirrors.items():
+            deletes.append(selector)
+            try:
+                self.client.delete(collection_name=collection_name, points_selector=selector)
+            except Exception as e:
+                logger.warning(f"Failed to mirror memory delete to {collection_name}: {e}")
+
     def delete(self, memory_id: str) -> None:
-        self.client.delete(
-            collection_name=MEMORY_COLLECTION,
-            points_selector=[memory_id],
-        )
+        self._delete([memory_id])
 
     def delete_all(self, user_id: Optional[str] = None) -> None:
         if user_id:
-            self.client.delete(
-                collection_name=MEMORY_COLLECTION,
-                points_selector=Filter(
+            self._delete(
+                Filter(
                     must=[
                         FieldCondition(key="user_id", match=MatchValue(value=user_id))
                     ]
                 ),
             )
+        elif self._mirrors:
+            # The collection being re-indexed can't be dropped; empty it and
+            # the copy instead.
+            self._delete(Filter(must=[]))
         else:
-            self.client.delete_collection(collection_name=MEMORY_COLLECTION)
+            # Dropping the aliased collection removes the alias as well; the
+            # next call recreates both.
+            collection_name = resolve_alias(self.client, MEMORY_ALIAS) or MEMORY_COLLECTION
+            self.client.delete_collection(collection_name=collection_name)
             self._collection_ensured = False
 
-    async def get_context(
+    async def get_scored_snippets(
         self,
         query: str,
         user_id: Optional[str] = None,
         limit: int = 5,
-    ) -> str:
+        query_vector: Optional[list[float]] = None,
+    ) -> tuple[list[str], float]:
         search_results = await self.search(
             query=query,
             user_id=user_id,
             limit=limit,
+            query_vector=query_vector,
         )
         logger.info(f"Memory search for user {user_id}: {len(search_results)} results")
+        top_score = search_results[0]["score"] if search_results else 0.0
 
         if not search_results:
             all_memories = await self.get_all(user_id=user_id, limit=limit)
@@ -189,7 +220,7 @@ class MemoryService:
                 search_results = all_memories
 
         if not search_results:
-            return ""
+            return [], 0.0
 
         context_parts = []
         for mem in search_results:
@@ -197,7 +228,7 @@ class MemoryService:
             if content:
                 context_parts.append(f"- {content}")
 
-        return "\n".join(context_parts)
+        return context_parts, top_score
 
 
 _memory_service: Optional[MemoryService] = None
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings, get_settings
+from app.db import get_db_session
+from app.db.postgres import Conversation, Message, MessageStatus, TurnTiming
+from app.services.memory import get_memory_service
+from app.services.session_cache import get_session_cache
+from app.services.summary import get_conversation_summarizer
+
+logger = logging.getLogger(__name__)
+
+WRITE_RETRIES = 3
+
+
+@dataclass
+class TurnRecord:
+    session_id: str
+    user_id: str
+    user_message: str
+    assistant_message: str
+    started_at: datetime
+    completed_at: datetime = field(default_factory=datetime.utcnow)
+    # "cancelled" when the client stopped the response part way.
+    status: str = "completed"
+
+
+def turn_messages(turn: TurnRecord) -> list[dict]:
+    # A turn cancelled before any output has no reply to keep.
+    messages = [{"role": "user", "content": turn.user_message, "created_at": turn.started_at.isoformat()}]
+    if turn.assistant_message:
+        messages.append(
+            {"role": "assistant", "content": turn.assistant_message, "created_at": turn.completed_at.isoformat()}
+        )
+    return messages
+
+
+async def persist_turns(db: AsyncSession, turns: list[TurnRecord]) -> None:
+    session_cache = get_session_cache()
+    session_ids = {turn.session_id for turn in turns}
+
+    # Conversation ids come from the session cache where possible, so a
+    # write for a known session doesn't read Postgres at all.
+    conversation_ids: dict[str, uuid.UUID] = {}
+    for session_id in session_ids:
+        cached = await session_cache.conversation_id(session_id)
+        if cached:
+            conversation_ids[session_id] = uuid.UUID(cached)
+
+    missing = session_ids - conversation_ids.keys()
+    if missing:
+        result = await db.execute(
+            select(Conversation.session_id, Conversation.id).where(Conversation.session_id.in_(missing))
+        )
+        conversation_ids.update(result.all())
+
+    created = set()
+    updated_at: dict[uuid.UUID, datetime] = {}
+    for turn in turns:
+        conversation_id = conversation_ids.get(turn.session_id)
+        if conversation_id is None:
+            conversation = Conversation(session_id=turn.session_id, user_id=turn.user_id)
+            db.add(conversation)
+            await db.flush()
+            conversation_id = conversation_ids[turn.session_id] = conversation.id
+            created.add(turn.session_id)
+
+        # Explicit timestamps keep the pair ordered even though both rows are
+        # written in the same flush, possibly long after the turn.
+        db.add(Message(
+            conversation_id=conversation_id,
+            role="user",
+            content=turn.user_message,
+            created_at=turn.started_at,
+        ))
+        if turn.assistant_message:
+            reply = Message(
+                id=uuid.uuid4(),
+                conversation_id=conversation_id,
+                role="assistant",
+                content=turn.assistant_message,
+                created_at=turn.completed_at,
+            )
+            db.add(reply)
+            if turn.status != "completed":
+                db.add(MessageStatus(message_id=reply.id, status=turn.status))
+        updated_at[conversation_id] = max(updated_at.get(conversation_id, turn.completed_at), turn.completed_at)
+
+    for conversation_id, timestamp in updated_at.items():
+        await db.execute(
+            update(Conversation).where(Conversation.id == conversation_id).values(updated_at=timestamp)
+        )
+
+    await db.commit()
+
+    for turn in turns:
+        await session_cache.append(
+            turn.session_id,
+            str(conversation_ids[turn.session_id]),
+            turn_messages(turn),
+            created=turn.session_id in created,
+        )
+
+
+class PersistenceQueue:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self._turns: asyncio.Queue[TurnRecord] = asyncio.Queue(maxsize=self.settings.PERSIST_QUEUE_SIZE)
+        self._memory_updates: asyncio.Queue[TurnRecord] = asyncio.Queue(maxsize=self.settings.PERSIST_QUEUE_SIZE)
+        self._timings: asyncio.Queue[TurnTiming] = asyncio.Queue(maxsize=self.settings.PERSIST_QUEUE_SIZE)
+        self._pending: dict[str, list[TurnRecord]] = {}
+        self._workers: list[asyncio.Task] = []
+        self._closed = False
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._write_loop()),
+                asyncio.create_task(self._memory_loop()),
+                asyncio.create_task(self._timing_loop()),
+            ]
+
+    async def submit(self, turn: TurnRecord) -> None:
+        if self._closed:
+            raise RuntimeError("Persistence queue is closed")
+
+        self.start()
+        self._pending.setdefault(turn.session_id, []).append(turn)
+        await self._turns.put(turn)
+        # A cut-off reply would be remembered as if it were the answer.
+        if turn.status == "completed":
+            await self._memory_updates.put(turn)
+
+    def record_timing(self, timing: TurnTiming) -> None:
+        # Timings are best effort and never hold up a turn.
+        if self._closed:
+            return
+
+        self.start()
+        try:
+            self._timings.put_nowait(timing)
+        except asyncio.QueueFull:
+            logger.warning("Timing queue full, dropping turn timing")
+
+    def pending_messages(self, session_id: str) -> list[dict]:
+        messages = []
+        for turn in self._pending.get(session_id, []):
+            messages.extend(turn_messages(turn))
+        return messages
+
+    async def _next_batch(self, queue: asyncio.Queue) -> list:
+        batch = [await queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.settings.PERSIST_FLUSH_INTERVAL
+        while len(batch) < self.settings.PERSIST_BATCH_SIZE:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _release(self, batch: list[TurnRecord]) -> None:
+        for turn in batch:
+            pending = self._pending.get(turn.session_id)
+            if pending and turn in pending:
+                pending.remove(turn)
+                if not pending:
+                    del self._pending[turn.session_id]
+
+    async def _write_loop(self) -> None:
+        while True:
+            batch = await self._next_batch(self._turns)
+            try:
+                await self._write(batch)
+            finally:
+                self._release(batch)
+                for _ in batch:
+                    self._turns.task_done()
+
+    async def _write(self, batch: list[TurnRecord]) -> None:
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                async with get_db_session() as db:
+                    await persist_turns(db, batch)
+                    # Released right after the commit, without yielding, so
+                    # history readers never see a turn both pending and stored.
+                    self._release(batch)
+                summarizer = get_conversation_summarizer()
+                for session_id in {turn.session_id for turn in batch}:
+                    summarizer.schedule(session_id)
+                return
+            except Exception as e:
+                if attempt == WRITE_RETRIES:
+                    logger.error(f"Dropping {len(batch)} chat turns after {attempt} failed writes: {e}")
+                    return
+                logger.warning(f"Failed to persist {len(batch)} chat turns (attempt {attempt}): {e}")
+                await asyncio.sleep(0.5 * attempt)
+
+    async def _memory_loop(self) -> None:
+        while True:
+            turn = await self._memory_updates.get()
+            try:
+                memory = await get_memory_service()
+                await memory.add_conversation(
+                    messages=[
+                        {"role": "user", "content": turn.user_message},
+                        {"role": "assistant", "content": turn.assistant_message},
+                    ],
+                    user_id=turn.user_id,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to update memory for user {turn.user_id}: {e}")
+            finally:
+                self._memory_updates.task_done()
+
+    async def _timing_loop(self) -> None:
+        while True:
+            batch = await self._next_batch(self._timings)
+            try:
+                async with get_db_session() as db:
+                    db.add_all(batch)
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Failed to record {len(batch)} turn timings: {e}")
+            finally:
+                for _ in batch:
+                    self._timings.task_done()
+
+    async def close(self) -> None:
+        self._closed = True
+        if not self._workers:
+            return
+
+        # Drain everything accepted so far before the process exits.
+        await self._turns.join()
+        await self._memory_updates.join()
+        await self._timings.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+_persistence_queue: Optional[PersistenceQueue] = None
+
+
+def get_persistence_queue() -> PersistenceQueue:
+    global _persistence_queue
+    if _persistence_queue is None:
+        _persistence_queue = PersistenceQueue()
+    return _persistence_queue
+
+
+async def close_persistence_queue() -> None:
+    global _persistence_queue
+    if _persistence_queue:
+        await _persistence_queue.close()
+        _persistence_queue = None
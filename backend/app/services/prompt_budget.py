@@ -0,0 +1,176 @@
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+import tiktoken
+
+from app.config import Settings, get_settings
+from app.db.postgres import LLMModel
+from app.services.embedding import get_encoding
+
+logger = logging.getLogger(__name__)
+
+# Role markers and separators each chat message adds on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+CHARS_PER_TOKEN = 4
+# Chat models don't share a tokenizer; cl100k_base is close enough to budget
+# a prompt.
+PROMPT_ENCODING = "cl100k_base"
+
+
+@lru_cache
+def _prompt_encoding() -> Optional[tiktoken.Encoding]:
+    # The failure is cached too: offline deployments that can't fetch the
+    # encoding fall back to a character estimate instead of retrying.
+    try:
+        return get_encoding(PROMPT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating prompt tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _prompt_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    if limit <= 0:
+        return ""
+    encoding = _prompt_encoding()
+    if encoding is None:
+        return text[:limit * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= limit else encoding.decode(tokens[:limit])
+
+
+def _fit_items(items: list[str], budget: int, separator: str) -> tuple[list[str], int]:
+    # Items come best first, so trimming from the end drops the lowest scores.
+    kept = []
+    used = 0
+    separator_tokens = count_tokens(separator)
+    for item in items:
+        cost = count_tokens(item) + (separator_tokens if kept else 0)
+        if used + cost > budget:
+            break
+        kept.append(item)
+        used += cost
+    return kept, used
+
+
+def _fit_history(history: list[dict], budget: int) -> tuple[list[dict], int]:
+    kept = []
+    used = 0
+    for message in reversed(history):
+        cost = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+
+    # Don't open the conversation with an orphaned assistant reply.
+    if kept and kept[-1]["role"] == "assistant":
+        used -= count_tokens(kept.pop()["content"]) + MESSAGE_OVERHEAD_TOKENS
+    kept.reverse()
+    return kept, used
+
+
+@dataclass
+class PromptPlan:
+    budget: int
+    fixed_tokens: int
+    context_chunks: list[str] = field(default_factory=list)
+    context_tokens: int = 0
+    context_dropped: int = 0
+    memory_snippets: list[str] = field(default_factory=list)
+    memory_tokens: int = 0
+    memory_dropped: int = 0
+    chat_history: list[dict] = field(default_factory=list)
+    history_tokens: int = 0
+    history_dropped: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.fixed_tokens + self.context_tokens + self.memory_tokens + self.history_tokens
+
+    def describe(self) -> str:
+        return (
+            f"{self.total_tokens}/{self.budget} tokens "
+            f"(fixed {self.fixed_tokens}, "
+            f"context {self.context_tokens} [-{self.context_dropped}], "
+            f"memory {self.memory_tokens} [-{self.memory_dropped}], "
+            f"history {self.history_tokens} [-{self.history_dropped}])"
+        )
+
+
+class PromptBudgeter:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+
+    def context_window(self, model: LLMModel) -> int:
+        return self.settings.PROMPT_CONTEXT_WINDOWS.get(
+            model.model_name, self.settings.PROMPT_CONTEXT_WINDOW
+        )
+
+    def input_budget(self, model: LLMModel) -> int:
+        # The model's max_tokens is reserved for the answer. A window smaller
+        # than that still leaves a quarter of it for the prompt.
+        window = self.context_window(model)
+        return max(window - model.max_tokens, window // 4)
+
+    def fit(
+        self,
+        model: LLMModel,
+        fixed: list[str],
+        context_chunks: list[str],
+        context_separator: str,
+        memory_snippets: list[str],
+        chat_history: list[dict],
+    ) -> PromptPlan:
+        budget = self.input_budget(model)
+        fixed_tokens = sum(count_tokens(text) for text in fixed) + 2 * MESSAGE_OVERHEAD_TOKENS
+        plan = PromptPlan(budget=budget, fixed_tokens=fixed_tokens)
+        available = max(budget - fixed_tokens, 0)
+
+        plan.memory_snippets, plan.memory_tokens = _fit_items(
+            memory_snippets, int(available * self.settings.PROMPT_MEMORY_SHARE), "\n"
+        )
+        context_budget = int(available * self.settings.PROMPT_CONTEXT_SHARE)
+        plan.context_chunks, plan.context_tokens = _fit_items(
+            context_chunks, context_budget, context_separator
+        )
+        plan.chat_history, plan.history_tokens = _fit_history(
+            chat_history, available - plan.memory_tokens - plan.context_tokens
+        )
+
+        # Room the history didn't need goes back to the retrieved context.
+        spare = available - plan.memory_tokens - plan.context_tokens - plan.history_tokens
+        if spare > 0 and len(plan.context_chunks) < len(context_chunks):
+            context_budget = plan.context_tokens + spare
+            plan.context_chunks, plan.context_tokens = _fit_items(
+                context_chunks, context_budget, context_separator
+            )
+
+        if context_chunks and not plan.context_chunks and context_budget > 0:
+            # A single chunk larger than the budget is cut rather than lost.
+            top = truncate_tokens(context_chunks[0], context_budget)
+            plan.context_chunks, plan.context_tokens = [top], count_tokens(top)
+
+        plan.context_dropped = len(context_chunks) - len(plan.context_chunks)
+        plan.memory_dropped = len(memory_snippets) - len(plan.memory_snippets)
+        plan.history_dropped = len(chat_history) - len(plan.chat_history)
+        return plan
+
+
+_prompt_budgeter: Optional[PromptBudgeter] = None
+
+
+def get_prompt_budgeter() -> PromptBudgeter:
+    global _prompt_budgeter
+    if _prompt_budgeter is None:
+        _prompt_budgeter = PromptBudgeter()
+    return _prompt_budgeter
@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 from typing import Optional
 
@@ -9,13 +10,111 @@ from qdrant_client.models import (
     Filter,
     FieldCondition,
     MatchValue,
+    SetPayload,
+    SetPayloadOperation,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
 )
 
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from app.config import Settings, get_settings
+from app.db.postgres import DocumentChunk
+from app.services.document import parent_span, stitch_chunks
 from app.services.embedding import get_embedding_service
 
 
 COLLECTION_NAME = "documents"
+COLLECTION_ALIAS = "documents_current"
+# Child hits fetched per requested parent window, since neighbouring children
+# collapse into the same window.
+SEARCH_OVERFETCH = 4
+
+
+def resolve_alias(client: QdrantClient, alias: str) -> Optional[str]:
+    for item in client.get_aliases().aliases:
+        if item.alias_name == alias:
+            return item.collection_name
+    return None
+
+
+def create_collection(client: QdrantClient, collection_name: str, dimension: int) -> None:
+    collection_names = [c.name for c in client.get_collections().collections]
+    if collection_name not in collection_names:
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=dimension, distance=Distance.COSINE),
+        )
+
+
+def ensure_alias(client: QdrantClient, alias: str, collection_name: str, dimension: int) -> None:
+    # Reads and writes always go through the alias so a re-index can swap the
+    # underlying collection; the first run points it at the legacy collection.
+    if resolve_alias(client, alias):
+        return
+
+    create_collection(client, collection_name, dimension)
+    switch_alias(client, alias, collection_name)
+
+
+def switch_alias(client: QdrantClient, alias: str, collection_name: str) -> Optional[str]:
+    previous = resolve_alias(client, alias)
+    operations = []
+    if previous:
+        operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+    operations.append(CreateAliasOperation(
+        create_alias=CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+
+    # Both operations are applied in a single request, so readers never see
+    # the alias missing.
+    client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+
+def chunk_payload(
+    document_id: str,
+    chunk: dict,
+    visibility: str = "global",
+    owner_id: Optional[str] = None,
+) -> dict:
+    return {
+        "document_id": document_id,
+        "chunk_index": chunk["chunk_index"],
+        "content": chunk["content"],
+        "content_hash": chunk["content_hash"],
+        "start_char": chunk.get("start_char"),
+        "end_char": chunk.get("end_char"),
+        "page_number": chunk.get("page_number"),
+        "visibility": visibility,
+        "owner_id": owner_id,
+    }
+
+
+def _merge_windows(windows: list[tuple[int, int, int, dict]]) -> list[tuple[int, int, int, dict]]:
+    # Windows are (start_char, end_char, rank, hit). Overlapping ones in the
+    # same document become one, carrying the best ranked hit.
+    by_document: dict[str, list[tuple[int, int, int, dict]]] = {}
+    for window in windows:
+        by_document.setdefault(window[3]["document_id"], []).append(window)
+
+    merged = []
+    for document_windows in by_document.values():
+        document_windows.sort(key=lambda window: window[0])
+        current = None
+        for start, end, rank, hit in document_windows:
+            if current and start < current[1]:
+                best_rank, best_hit = min((current[2], current[3]), (rank, hit), key=lambda item: item[0])
+                current = (current[0], max(current[1], end), best_rank, best_hit)
+            else:
+                if current:
+                    merged.append(current)
+                current = (start, end, rank, hit)
+        merged.append(current)
+    return merged
 
 
 class QdrantService:
@@ -36,20 +135,14 @@ class QdrantService:
         if not self.embedding_service._initialized:
             await self.embedding_service.initialize()
 
-        collections = self.client.get_collections().collections
-        collection_names = [c.name for c in collections]
-
-        if COLLECTION_NAME not in collection_names:
-            self.client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(
-                    size=self.embedding_service.dimension,
-                    distance=Distance.COSINE,
-                ),
-            )
-
+        ensure_alias(self.client, COLLECTION_ALIAS, COLLECTION_NAME, self.embedding_service.dimension)
         self._collection_ensured = True
 
+    def _collection(self) -> str:
+        if self._collection_ensured:
+            return COLLECTION_ALIAS
+        return resolve_alias(self.client, COLLECTION_ALIAS) or COLLECTION_NAME
+
     async def add_chunks(
         self,
         document_id: str,
@@ -60,10 +153,30 @@ class QdrantService:
         if not chunks:
             return []
 
+        embeddings = await self.embed_chunks(chunks)
+        return await asyncio.to_thread(
+            self.upsert_chunks, document_id, chunks, embeddings, visibility, owner_id
+        )
+
+    async def embed_chunks(self, chunks: list[dict]) -> list[list[float]]:
+        if not chunks:
+            return []
+
         await self._ensure_collection()
 
         texts = [chunk["content"] for chunk in chunks]
-        embeddings = await self.embedding_service.embed_batch(texts)
+        return await self.embedding_service.embed_batch(texts)
+
+    def upsert_chunks(
+        self,
+        document_id: str,
+        chunks: list[dict],
+        embeddings: list[list[float]],
+        visibility: str = "global",
+        owner_id: Optional[str] = None,
+    ) -> list[str]:
+        if not chunks:
+            return []
 
         points = []
         vector_ids = []
@@ -75,20 +188,10 @@ class QdrantService:
             points.append(PointStruct(
                 id=vector_id,
                 vector=embedding,
-                payload={
-                    "document_id": document_id,
-                    "chunk_index": chunk["chunk_index"],
-                    "content": chunk["content"],
-                    "content_hash": chunk["content_hash"],
-                    "start_char": chunk.get("start_char"),
-                    "end_char": chunk.get("end_char"),
-                    "page_number": chunk.get("page_number"),
-                    "visibility": visibility,
-                    "owner_id": owner_id,
-                },
+                payload=chunk_payload(document_id, chunk, visibility, owner_id),
             ))
 
-        self.client.upsert(collection_name=COLLECTION_NAME, points=points)
+        self.client.upsert(collection_name=COLLECTION_ALIAS, points=points)
         return vector_ids
 
     async def search(
@@ -97,10 +200,12 @@ class QdrantService:
         limit: int = 5,
         visibility: str = "global",
         owner_id: Optional[str] = None,
+        query_vector: Optional[list[float]] = None,
     ) -> list[dict]:
         await self._ensure_collection()
 
-        query_vector = await self.embedding_service.embed(query)
+        if query_vector is None:
+            query_vector = await self.embedding_service.embed(query)
 
         filter_conditions = [
             FieldCondition(key="visibility", match=MatchValue(value=visibility))
@@ -111,12 +216,18 @@ class QdrantService:
                 FieldCondition(key="owner_id", match=MatchValue(value=owner_id))
             )
 
-        results = self.client.query_points(
-            collection_name=COLLECTION_NAME,
+        # Parent windows are built from neighbouring children, so more hits
+        # are fetched than windows returned; see expand_parents.
+        parent_size = self.settings.CHUNK_PARENT_SIZE
+        # The client is synchronous; off the event loop, the search overlaps
+        # with the memory search and history read running beside it.
+        results = (await asyncio.to_thread(
+            self.client.query_points,
+            collection_name=COLLECTION_ALIAS,
             query=query_vector,
             query_filter=Filter(must=filter_conditions) if filter_conditions else None,
-            limit=limit,
-        ).points
+            limit=limit * SEARCH_OVERFETCH if parent_size else limit,
+        )).points
 
         return [
             {
@@ -126,13 +237,88 @@ class QdrantService:
                 "chunk_index": result.payload.get("chunk_index"),
                 "content": result.payload.get("content"),
                 "page_number": result.payload.get("page_number"),
+                "start_char": result.payload.get("start_char"),
+                "end_char": result.payload.get("end_char"),
             }
             for result in results
         ]
 
+    async def expand_parents(self, db: AsyncSession, hits: list[dict], limit: int) -> list[dict]:
+        # Replaces child hits with their surrounding text, taking the caller's
+        # session rather than opening one per search. Windows that overlap in
+        # the same document are merged, so no text is returned twice; each
+        # result keeps the rank and metadata of its best hit.
+        parent_size = self.settings.CHUNK_PARENT_SIZE
+        if not parent_size:
+            return hits[:limit]
+
+        parents = []
+        windows = []
+        for rank, hit in enumerate(hits):
+            if hit["start_char"] is None or hit["end_char"] is None:
+                parents.append((rank, hit))
+            else:
+                start, end = parent_span(hit["start_char"], hit["end_char"], parent_size)
+                windows.append((start, end, rank, hit))
+
+        windows = _merge_windows(windows)
+        kept = set(sorted([rank for rank, _ in parents] + [window[2] for window in windows])[:limit])
+        parents = [parent for parent in parents if parent[0] in kept]
+        windows = [window for window in windows if window[2] in kept]
+        if not windows:
+            return [hit for _, hit in parents]
+
+        result = await db.execute(
+            select(
+                DocumentChunk.document_id,
+                DocumentChunk.start_char,
+                DocumentChunk.end_char,
+                DocumentChunk.content,
+            )
+            .where(or_(*(
+                and_(
+                    DocumentChunk.document_id == uuid.UUID(hit["document_id"]),
+                    DocumentChunk.end_char > start,
+                    DocumentChunk.start_char < end,
+                )
+                for start, end, _, hit in windows
+            )))
+            .order_by(DocumentChunk.document_id, DocumentChunk.start_char)
+        )
+        rows = result.all()
+
+        # Snapped to the chunks they touch, neighbouring windows can share a
+        # chunk; those are merged once more before stitching.
+        snapped = []
+        for start, end, rank, hit in windows:
+            chunks = [
+                (chunk_start, chunk_end)
+                for document_id, chunk_start, chunk_end, _ in rows
+                if str(document_id) == hit["document_id"] and chunk_end > start and chunk_start < end
+            ]
+            if chunks:
+                snapped.append((chunks[0][0], max(e for _, e in chunks), rank, hit))
+            else:
+                parents.append((rank, hit))
+
+        for start, end, rank, hit in _merge_windows(snapped):
+            chunks = [
+                (chunk_start, chunk_end, content)
+                for document_id, chunk_start, chunk_end, content in rows
+                if str(document_id) == hit["document_id"] and chunk_start >= start and chunk_end <= end
+            ]
+            parents.append((rank, {
+                **hit,
+                "content": stitch_chunks(chunks),
+                "start_char": start,
+                "end_char": end,
+            }))
+
+        return [item for _, item in sorted(parents, key=lambda parent: parent[0])]
+
     def delete_by_document(self, document_id: str) -> None:
         self.client.delete(
-            collection_name=COLLECTION_NAME,
+            collection_name=self._collection(),
             points_selector=Filter(
                 must=[
                     FieldCondition(
@@ -143,10 +329,35 @@ class QdrantService:
             ),
         )
 
+    def delete_points(self, vector_ids: list[str]) -> None:
+        if not vector_ids:
+            return
+
+        self.client.delete(
+            collection_name=self._collection(),
+            points_selector=vector_ids,
+        )
+
+    def update_payloads(self, updates: list[tuple[str, dict]]) -> None:
+        if not updates:
+            return
+
+        self.client.batch_update_points(
+            collection_name=self._collection(),
+            update_operations=[
+                SetPayloadOperation(
+                    set_payload=SetPayload(payload=payload, points=[vector_id])
+                )
+                for vector_id, payload in updates
+            ],
+        )
+
     def get_collection_info(self) -> dict:
-        info = self.client.get_collection(collection_name=COLLECTION_NAME)
+        collection_name = resolve_alias(self.client, COLLECTION_ALIAS) or COLLECTION_NAME
+        info = self.client.get_collection(collection_name=collection_name)
         return {
-            "name": COLLECTION_NAME,
+            "name": collection_name,
+            "alias": COLLECTION_ALIAS,
             "vectors_count": info.vectors_count,
             "points_count": info.points_count,
         }
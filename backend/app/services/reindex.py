@@ -0,0 +1,358 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from qdrant_client.models import (
+    DatetimeRange,
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PointStruct,
+)
+from sqlalchemy import or_, select, tuple_
+
+from app.config import Settings, get_settings
+from app.db import get_db_session
+from app.db.postgres import Document, DocumentChunk
+from app.db.redis import RedisCache, get_redis
+from app.services.answer_cache import bump_corpus_version
+from app.services.embedding import get_embedding_service
+from app.services.memory import MEMORY_ALIAS, MEMORY_COLLECTION, get_memory_service
+from app.services.qdrant import (
+    COLLECTION_ALIAS,
+    COLLECTION_NAME,
+    chunk_payload,
+    create_collection,
+    ensure_alias,
+    get_qdrant_service,
+    resolve_alias,
+    switch_alias,
+)
+
+logger = logging.getLogger(__name__)
+
+REINDEX_STATE_KEY = "reindex:state"
+REINDEX_STATE_TTL = 30 * 24 * 3600
+
+
+def _chunk_dict(chunk: DocumentChunk) -> dict:
+    return {
+        "chunk_index": chunk.chunk_index,
+        "content": chunk.content,
+        "content_hash": chunk.content_hash,
+        "start_char": chunk.start_char,
+        "end_char": chunk.end_char,
+        "page_number": chunk.page_number,
+    }
+
+
+class ReindexService:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.qdrant = get_qdrant_service()
+        self.client = self.qdrant.client
+        self.embedding_service = get_embedding_service()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _cache(self) -> RedisCache:
+        return RedisCache(await get_redis())
+
+    async def get_state(self) -> Optional[dict]:
+        cache = await self._cache()
+        data = await cache.get(REINDEX_STATE_KEY)
+        return json.loads(data) if data else None
+
+    async def _save_state(self, state: dict) -> None:
+        state["updated_at"] = datetime.utcnow().isoformat()
+        cache = await self._cache()
+        await cache.set(REINDEX_STATE_KEY, json.dumps(state), expire=REINDEX_STATE_TTL)
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> dict:
+        if self.is_running():
+            return await self.get_state()
+
+        if not self.embedding_service._initialized:
+            await self.embedding_service.initialize()
+
+        dimension = self.embedding_service.dimension
+        ensure_alias(self.client, COLLECTION_ALIAS, COLLECTION_NAME, dimension)
+        ensure_alias(self.client, MEMORY_ALIAS, MEMORY_COLLECTION, dimension)
+
+        state = await self.get_state()
+        if state and state["status"] != "completed" and state["dimension"] == dimension:
+            logger.info(f"Resuming re-index {state['version']} at stage {state['stage']}")
+        else:
+            version = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+            state = {
+                "version": version,
+                "stage": "documents",
+                "dimension": dimension,
+                "documents_collection": f"{COLLECTION_NAME}_{version}",
+                "memories_collection": f"{MEMORY_COLLECTION}_{version}",
+                "source_memories_collection": resolve_alias(self.client, MEMORY_ALIAS),
+                "started_at": datetime.utcnow().isoformat(),
+                "refresh_since": None,
+                "chunk_cursor": None,
+                "memory_offset": None,
+                "chunks_indexed": 0,
+                "memories_indexed": 0,
+                "previous_collections": [],
+            }
+
+        create_collection(self.client, state["documents_collection"], dimension)
+        create_collection(self.client, state["memories_collection"], dimension)
+        memory = await get_memory_service()
+        memory.start_mirroring(state["memories_collection"])
+
+        state["status"] = "running"
+        state["error"] = None
+        await self._save_state(state)
+
+        self._task = asyncio.create_task(self._run(state))
+        return state
+
+    async def _run(self, state: dict) -> None:
+        try:
+            if state["stage"] == "documents":
+                await self._copy_chunks(state)
+                state["stage"] = "memories"
+                await self._save_state(state)
+
+            if state["stage"] == "memories":
+                await self._copy_memories(state)
+                state["stage"] = "switch"
+                await self._save_state(state)
+
+            if state["stage"] == "switch":
+                # Documents changed while copying are rebuilt before the swap,
+                # and once more afterwards for writes that raced the swap.
+                refresh_since = datetime.utcnow().isoformat()
+                await self._refresh_documents(state, state["started_at"])
+                memory = await get_memory_service()
+                memory.replay_deletes(state["memories_collection"])
+                previous = [
+                    switch_alias(self.client, COLLECTION_ALIAS, state["documents_collection"]),
+                    switch_alias(self.client, MEMORY_ALIAS, state["memories_collection"]),
+                ]
+                state["previous_collections"] = [name for name in previous if name]
+                await bump_corpus_version()
+                state["refresh_since"] = refresh_since
+                state["stage"] = "catch_up"
+                await self._save_state(state)
+                logger.info(f"Re-index {state['version']}: aliases switched")
+
+            if state["stage"] == "catch_up":
+                await self._refresh_documents(state, state["refresh_since"])
+                await self._copy_new_memories(state)
+                # The catch-up copies from the old collection, which stopped
+                # receiving deletes at the swap.
+                memory = await get_memory_service()
+                memory.replay_deletes(state["memories_collection"])
+                memory.stop_mirroring(state["memories_collection"])
+
+            state["status"] = "completed"
+            state["stage"] = "done"
+            await self._save_state(state)
+            logger.info(
+                f"Re-index {state['version']} completed: {state['chunks_indexed']} chunks, "
+                f"{state['memories_indexed']} memories"
+            )
+        except Exception as e:
+            logger.exception(f"Re-index {state['version']} failed at stage {state['stage']}")
+            state["status"] = "failed"
+            state["error"] = str(e)
+            await self._save_state(state)
+
+    async def _throttle(self, count: int, started: float) -> None:
+        rate = self.settings.REINDEX_MAX_PER_SECOND
+        if rate <= 0:
+            await asyncio.sleep(0)
+            return
+
+        remaining = count / rate - (time.monotonic() - started)
+        await asyncio.sleep(max(remaining, 0))
+
+    async def _embed_and_upsert(self, collection_name: str, points: list[tuple[str, str, dict]]) -> None:
+        if not points:
+            return
+
+        embeddings = await self.embedding_service.embed_batch([text for _, text, _ in points])
+        self.client.upsert(
+            collection_name=collection_name,
+            points=[
+                PointStruct(id=point_id, vector=embedding, payload=payload)
+                for (point_id, _, payload), embedding in zip(points, embeddings)
+            ],
+        )
+
+    def _chunk_points(self, rows) -> list[tuple[str, str, dict]]:
+        points = []
+        for chunk, visibility, owner_id in rows:
+            # Keep the existing point ids so DocumentChunk.vector_id stays valid
+            # in the new collection.
+            if not chunk.vector_id:
+                continue
+            payload = chunk_payload(
+                str(chunk.document_id),
+                _chunk_dict(chunk),
+                visibility,
+                str(owner_id) if owner_id else None,
+            )
+            points.append((chunk.vector_id, chunk.content, payload))
+        return points
+
+    async def _copy_chunks(self, state: dict) -> None:
+        batch_size = self.settings.REINDEX_BATCH_SIZE
+        started_at = datetime.fromisoformat(state["started_at"])
+
+        while True:
+            started = time.monotonic()
+            async with get_db_session() as db:
+                query = (
+                    select(DocumentChunk, Document.visibility, Document.owner_id)
+                    .join(Document, DocumentChunk.document_id == Document.id)
+                    .where(
+                        Document.deleted_at.is_(None),
+                        DocumentChunk.created_at <= started_at,
+                    )
+                )
+                if state["chunk_cursor"]:
+                    created_at, chunk_id = state["chunk_cursor"]
+                    query = query.where(
+                        tuple_(DocumentChunk.created_at, DocumentChunk.id)
+                        > (datetime.fromisoformat(created_at), uuid.UUID(chunk_id))
+                    )
+                result = await db.execute(
+                    query.order_by(DocumentChunk.created_at, DocumentChunk.id).limit(batch_size)
+                )
+                rows = result.all()
+
+            if not rows:
+                return
+
+            await self._embed_and_upsert(state["documents_collection"], self._chunk_points(rows))
+
+            last = rows[-1][0]
+            state["chunk_cursor"] = [last.created_at.isoformat(), str(last.id)]
+            state["chunks_indexed"] += len(rows)
+            await self._save_state(state)
+            await self._throttle(len(rows), started)
+
+    async def _refresh_documents(self, state: dict, since: str) -> None:
+        collection_name = state["documents_collection"]
+        since_dt = datetime.fromisoformat(since)
+
+        async with get_db_session() as db:
+            result = await db.execute(
+                select(Document.id, Document.deleted_at).where(
+                    or_(Document.updated_at >= since_dt, Document.deleted_at >= since_dt)
+                )
+            )
+            documents = result.all()
+
+        for document_id, deleted_at in documents:
+            self.client.delete(
+                collection_name=collection_name,
+                points_selector=Filter(must=[
+                    FieldCondition(key="document_id", match=MatchValue(value=str(document_id)))
+                ]),
+            )
+            if deleted_at is not None:
+                continue
+
+            async with get_db_session() as db:
+                result = await db.execute(
+                    select(DocumentChunk, Document.visibility, Document.owner_id)
+                    .join(Document, DocumentChunk.document_id == Document.id)
+                    .where(DocumentChunk.document_id == document_id)
+                    .order_by(DocumentChunk.chunk_index)
+                )
+                rows = result.all()
+
+            batch_size = self.settings.REINDEX_BATCH_SIZE
+            for i in range(0, len(rows), batch_size):
+                started = time.monotonic()
+                batch = rows[i:i + batch_size]
+                await self._embed_and_upsert(collection_name, self._chunk_points(batch))
+                state["chunks_indexed"] += len(batch)
+                await self._throttle(len(batch), started)
+
+        await self._save_state(state)
+
+    def _memory_points(self, records) -> list[tuple[str, str, dict]]:
+        return [
+            (str(record.id), record.payload.get("content", ""), record.payload)
+            for record in records
+            if record.payload and record.payload.get("content")
+        ]
+
+    async def _copy_memories(self, state: dict) -> None:
+        source = state["source_memories_collection"]
+        if not source:
+            return
+
+        while True:
+            started = time.monotonic()
+            records, next_offset = self.client.scroll(
+                collection_name=source,
+                limit=self.settings.REINDEX_BATCH_SIZE,
+                offset=state["memory_offset"],
+                with_payload=True,
+                with_vectors=False,
+            )
+            if records:
+                await self._embed_and_upsert(state["memories_collection"], self._memory_points(records))
+                state["memories_indexed"] += len(records)
+
+            if next_offset is None:
+                return
+
+            state["memory_offset"] = str(next_offset)
+            await self._save_state(state)
+            await self._throttle(len(records), started)
+
+    async def _copy_new_memories(self, state: dict) -> None:
+        source = state["source_memories_collection"]
+        if not source:
+            return
+
+        offset = None
+        while True:
+            started = time.monotonic()
+            records, offset = self.client.scroll(
+                collection_name=source,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="created_at", range=DatetimeRange(gte=state["started_at"]))
+                ]),
+                limit=self.settings.REINDEX_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            if records:
+                await self._embed_and_upsert(state["memories_collection"], self._memory_points(records))
+                state["memories_indexed"] += len(records)
+
+            if offset is None:
+                await self._save_state(state)
+                return
+
+            await self._throttle(len(records), started)
+
+
+_reindex_service: Optional[ReindexService] = None
+
+
+def get_reindex_service() -> ReindexService:
+    global _reindex_service
+    if _reindex_service is None:
+        _reindex_service = ReindexService()
+    return _reindex_service
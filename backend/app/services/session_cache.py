@@ -0,0 +1,179 @@
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import Settings, get_settings
+from app.db.postgres import Conversation, ConversationSummary, Message
+from app.db.redis import RedisCache, get_redis
+
+logger = logging.getLogger(__name__)
+
+SESSION_STATE_PREFIX = "session:state:"
+SESSION_MESSAGES_PREFIX = "session:messages:"
+
+
+def merge_messages(*histories: list[dict]) -> list[dict]:
+    # The same message can show up both as pending and as stored while a
+    # write is in flight; its role and timestamp identify it.
+    seen = set()
+    merged = []
+    for history in histories:
+        for message in history:
+            key = (message["role"], message["created_at"])
+            if key not in seen:
+                seen.add(key)
+                merged.append(message)
+    return merged
+
+
+@dataclass
+class SessionState:
+    conversation_id: Optional[str] = None
+    summary: str = ""
+    summarized_until: Optional[str] = None
+    messages: list[dict] = field(default_factory=list)
+
+
+class SessionCache:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+
+    async def _cache(self) -> RedisCache:
+        return RedisCache(await get_redis())
+
+    async def _load_state(self, cache: RedisCache, session_id: str) -> Optional[SessionState]:
+        data = await cache.get(f"{SESSION_STATE_PREFIX}{session_id}")
+        return SessionState(**json.loads(data)) if data else None
+
+    async def _save_state(self, cache: RedisCache, session_id: str, state: SessionState) -> None:
+        payload = asdict(state)
+        payload.pop("messages")
+        await cache.set(
+            f"{SESSION_STATE_PREFIX}{session_id}",
+            json.dumps(payload),
+            expire=self.settings.SESSION_CACHE_TTL,
+        )
+
+    async def _push(self, cache: RedisCache, session_id: str, messages: list[dict]) -> None:
+        key = f"{SESSION_MESSAGES_PREFIX}{session_id}"
+        if messages:
+            # Newest first, so trimming keeps the most recent messages.
+            await cache.lpush(key, *(json.dumps(m) for m in messages))
+            await cache.ltrim(key, 0, self.settings.SESSION_CACHE_MESSAGES - 1)
+        await cache.expire(key, self.settings.SESSION_CACHE_TTL)
+
+    async def get(self, session_id: str) -> Optional[SessionState]:
+        try:
+            cache = await self._cache()
+            state = await self._load_state(cache, session_id)
+            if state is None:
+                return None
+            raw = await cache.lrange(
+                f"{SESSION_MESSAGES_PREFIX}{session_id}", 0, self.settings.SESSION_CACHE_MESSAGES - 1
+            )
+            state.messages = [json.loads(m) for m in reversed(raw)]
+            return state
+        except Exception as e:
+            logger.warning(f"Session cache read failed for {session_id}: {e}")
+            return None
+
+    async def conversation_id(self, session_id: str) -> Optional[str]:
+        try:
+            state = await self._load_state(await self._cache(), session_id)
+            return state.conversation_id if state else None
+        except Exception as e:
+            logger.warning(f"Session cache read failed for {session_id}: {e}")
+            return None
+
+    async def rebuild(self, db: AsyncSession, session_id: str, pending: list[dict]) -> SessionState:
+        # Pending turns are taken before reading Postgres and stored with the
+        # rebuilt history: a turn committed in between skipped the cache
+        # because there was no state yet, and would otherwise be lost.
+        state = SessionState()
+        result = await db.execute(
+            select(Conversation.id, ConversationSummary.summary, ConversationSummary.summarized_until)
+            .outerjoin(ConversationSummary, ConversationSummary.conversation_id == Conversation.id)
+            .where(Conversation.session_id == session_id)
+        )
+        row = result.first()
+
+        history = []
+        if row:
+            conversation_id, summary, summarized_until = row
+            state.conversation_id = str(conversation_id)
+            state.summary = summary or ""
+            state.summarized_until = summarized_until.isoformat() if summarized_until else None
+
+            query = select(Message).where(Message.conversation_id == conversation_id)
+            if summarized_until:
+                query = query.where(Message.created_at > summarized_until)
+            result = await db.execute(
+                query.order_by(Message.created_at.desc()).limit(self.settings.SESSION_CACHE_MESSAGES)
+            )
+            history = [
+                {"role": m.role, "content": m.content, "created_at": m.created_at.isoformat()}
+                for m in reversed(result.scalars().all())
+            ]
+
+        state.messages = merge_messages(history, pending)
+
+        try:
+            cache = await self._cache()
+            await cache.delete(f"{SESSION_MESSAGES_PREFIX}{session_id}")
+            await self._push(cache, session_id, state.messages)
+            await self._save_state(cache, session_id, state)
+        except Exception as e:
+            logger.warning(f"Session cache write failed for {session_id}: {e}")
+        return state
+
+    async def append(
+        self,
+        session_id: str,
+        conversation_id: str,
+        messages: list[dict],
+        created: bool = False,
+    ) -> None:
+        # Written through after each commit. Without cached state the history
+        # would be incomplete, so it is left for the next read to rebuild,
+        # unless the conversation was only just created.
+        try:
+            cache = await self._cache()
+            state = await self._load_state(cache, session_id)
+            if state is None and not created:
+                return
+
+            state = state or SessionState()
+            await self._push(cache, session_id, messages)
+            if state.conversation_id != conversation_id or created:
+                state.conversation_id = conversation_id
+                await self._save_state(cache, session_id, state)
+        except Exception as e:
+            logger.warning(f"Session cache write failed for {session_id}: {e}")
+
+    async def set_summary(self, session_id: str, summary: str, summarized_until: datetime) -> None:
+        try:
+            cache = await self._cache()
+            state = await self._load_state(cache, session_id)
+            if state is None:
+                return
+            state.summary = summary
+            state.summarized_until = summarized_until.isoformat()
+            await self._save_state(cache, session_id, state)
+        except Exception as e:
+            logger.warning(f"Session cache write failed for {session_id}: {e}")
+
+
+_session_cache: Optional[SessionCache] = None
+
+
+def get_session_cache() -> SessionCache:
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = SessionCache()
+    return _session_cache
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import orjson
+
+from app.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event_id: str, event: str, data: str) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[tuple[str, int]]:
+    # Event ids are "<stream id>:<sequence>".
+    if not value:
+        return None
+    stream_id, _, seq = value.strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class SSEStream:
+    # One turn's events, kept in order so a client that reconnects with
+    # Last-Event-ID gets whatever it missed. Generation runs in its own task:
+    # once the last listener goes, it is cancelled unless a client resumes
+    # within SSE_RESUME_GRACE.
+
+    def __init__(self, session_id: str, user_id: str, settings: Settings):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.user_id = user_id
+        self.settings = settings
+        self.events: list[tuple[str, str]] = []
+        self.done = False
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._listeners = 0
+        self._pending_cancel: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, event: str, data: dict) -> None:
+        self.events.append((event, orjson.dumps(data).decode()))
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        if self._pending_cancel:
+            self._pending_cancel.cancel()
+            self._pending_cancel = None
+        self._notify()
+
+    def _notify(self) -> None:
+        # Wakes every listener; each waits on the event current when it
+        # caught up.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def cancel(self) -> None:
+        if self.task and not self.task.done():
+            logger.info(f"Cancelling SSE stream {self.id} for session {self.session_id}")
+            self.task.cancel()
+
+    def _attach(self) -> None:
+        self._listeners += 1
+        if self._pending_cancel:
+            self._pending_cancel.cancel()
+            self._pending_cancel = None
+
+    def _detach(self) -> None:
+        self._listeners -= 1
+        if self._listeners or self.done:
+            return
+        grace = self.settings.SSE_RESUME_GRACE
+        if grace > 0:
+            self._pending_cancel = asyncio.get_running_loop().call_later(grace, self.cancel)
+        else:
+            self.cancel()
+
+    async def listen(self, after: int = 0) -> AsyncIterator[str]:
+        self._attach()
+        try:
+            seq = after
+            while True:
+                while seq < len(self.events):
+                    event, data = self.events[seq]
+                    seq += 1
+                    yield format_event(f"{self.id}:{seq}", event, data)
+                if self.done:
+                    return
+
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), self.settings.SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Comment line, so proxies don't drop a quiet stream.
+                    yield ": keepalive\n\n"
+        finally:
+            self._detach()
+
+
+class SSEStreamRegistry:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self._streams: dict[str, SSEStream] = {}
+
+    def open(
+        self,
+        session_id: str,
+        user_id: str,
+        produce: Callable[[SSEStream], Awaitable[None]],
+    ) -> SSEStream:
+        stream = SSEStream(session_id, user_id, self.settings)
+        self._streams[stream.id] = stream
+        stream.task = asyncio.create_task(self._run(stream, produce))
+        return stream
+
+    async def _run(self, stream: SSEStream, produce: Callable[[SSEStream], Awaitable[None]]) -> None:
+        try:
+            await produce(stream)
+        except asyncio.CancelledError:
+            stream.publish("cancelled", {})
+            raise
+        finally:
+            stream.finish()
+            # Finished streams stay around for late resumes.
+            asyncio.get_running_loop().call_later(
+                self.settings.SSE_RESUME_TTL, self._streams.pop, stream.id, None
+            )
+
+    def get(self, stream_id: str, session_id: str, user_id: str) -> Optional[SSEStream]:
+        # Only the client that started a stream may resume it; anyone else
+        # sees it as missing.
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.session_id != session_id or stream.user_id != user_id:
+            return None
+        return stream
+
+    async def close(self) -> None:
+        streams = list(self._streams.values())
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*(s.task for s in streams if s.task), return_exceptions=True)
+        self._streams.clear()
+
+
+_sse_streams: Optional[SSEStreamRegistry] = None
+
+
+def get_sse_streams() -> SSEStreamRegistry:
+    global _sse_streams
+    if _sse_streams is None:
+        _sse_streams = SSEStreamRegistry()
+    return _sse_streams
+
+
+async def close_sse_streams() -> None:
+    global _sse_streams
+    if _sse_streams:
+        await _sse_streams.close()
+        _sse_streams = None
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+
+from app.config import Settings, get_settings
+from app.db import get_db_session
+from app.db.postgres import Conversation, ConversationSummary, Message
+from app.services.llm import get_llm_service
+from app.services.session_cache import get_session_cache
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """
+You keep a running summary of a customer support conversation.
+
+Update the current summary with the new messages. Keep the customer's name and any details they shared, the questions they asked, the answers they were given and anything still unresolved. Drop greetings and small talk.
+
+Write plain prose, at most {max_words} words. Reply with the summary only.
+"""
+
+
+class ConversationSummarizer:
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.llm = get_llm_service()
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def schedule(self, session_id: str) -> None:
+        if not self.settings.SUMMARY_ENABLED:
+            return
+
+        # One summary at a time per session; a turn that lands meanwhile is
+        # picked up by the next run.
+        task = self._tasks.get(session_id)
+        if task and not task.done():
+            return
+
+        task = asyncio.create_task(self._run(session_id))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda t: self._forget(session_id, t))
+
+    def _forget(self, session_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(session_id) is task:
+            del self._tasks[session_id]
+
+    async def _run(self, session_id: str) -> None:
+        try:
+            await self.summarize(session_id)
+        except Exception as e:
+            logger.warning(f"Failed to summarize conversation {session_id}: {e}")
+
+    def _format_messages(self, messages: list[Message]) -> str:
+        speakers = {"user": "Customer", "assistant": "Assistant"}
+        return "\n".join(f"{speakers.get(m.role, m.role)}: {m.content}" for m in messages)
+
+    async def summarize(self, session_id: str) -> bool:
+        # The LLM call can take seconds, so it runs between two short sessions
+        # instead of holding a pooled connection.
+        async with get_db_session() as db:
+            result = await db.execute(
+                select(Conversation.id, ConversationSummary.summary, ConversationSummary.summarized_until)
+                .outerjoin(ConversationSummary, ConversationSummary.conversation_id == Conversation.id)
+                .where(Conversation.session_id == session_id)
+            )
+            row = result.first()
+            if row is None:
+                return False
+            conversation_id, current, summarized_until = row
+
+            query = select(Message).where(Message.conversation_id == conversation_id)
+            if summarized_until:
+                query = query.where(Message.created_at > summarized_until)
+            result = await db.execute(query.order_by(Message.created_at))
+            messages = result.scalars().all()
+
+            if len(messages) <= self.settings.SUMMARY_TRIGGER_MESSAGES:
+                return False
+
+            client, _, _ = await self.llm.get_client(db)
+
+        # The newest messages stay raw in the prompt; everything older is
+        # folded into the summary.
+        folded = messages[:len(messages) - self.settings.SUMMARY_KEEP_MESSAGES]
+        prompt = self.llm.create_messages(
+            user_message=(
+                f"Current summary:\n{current or 'None yet.'}\n\n"
+                f"New messages:\n{self._format_messages(folded)}"
+            ),
+            system_prompt=SUMMARY_PROMPT.format(max_words=self.settings.SUMMARY_MAX_WORDS),
+        )
+        text = (await client.ainvoke(prompt)).content.strip()
+        if not text:
+            return False
+
+        async with get_db_session() as db:
+            result = await db.execute(
+                select(ConversationSummary).where(ConversationSummary.conversation_id == conversation_id)
+            )
+            summary = result.scalar_one_or_none()
+            if summary is None:
+                summary = ConversationSummary(conversation_id=conversation_id, message_count=0)
+                db.add(summary)
+            elif summary.summarized_until != summarized_until:
+                # Another worker folded these messages in meanwhile.
+                return False
+            summary.summary = text
+            summary.summarized_until = folded[-1].created_at
+            summary.message_count += len(folded)
+            summary.updated_at = datetime.utcnow()
+            await db.commit()
+
+        await get_session_cache().set_summary(session_id, text, folded[-1].created_at)
+        logger.info(f"Summarized {len(folded)} messages of conversation {session_id}")
+        return True
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+_conversation_summarizer: Optional[ConversationSummarizer] = None
+
+
+def get_conversation_summarizer() -> ConversationSummarizer:
+    global _conversation_summarizer
+    if _conversation_summarizer is None:
+        _conversation_summarizer = ConversationSummarizer()
+    return _conversation_summarizer
+
+
+async def close_conversation_summarizer() -> None:
+    global _conversation_summarizer
+    if _conversation_summarizer:
+        await _conversation_summarizer.close()
+        _conversation_summarizer = None
@@ -0,0 +1,113 @@
+"""Rows/s for per-object ORM inserts versus the bulk insert path.
+
+Needs the Postgres instance from the app settings. Each run creates a scratch
+document, inserts the chunks and deletes it again.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_chunk_insert --chunks 10000
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+import uuid
+
+from sqlalchemy import delete
+
+from app.db import async_session, engine, init_db
+from app.db.postgres import Document, DocumentChunk
+from app.services.ingestion import insert_chunks
+
+
+def make_chunks(count: int) -> list[dict]:
+    chunks = []
+    for i in range(count):
+        content = f"Chunk {i}: " + "lorem ipsum dolor sit amet " * 18
+        chunks.append({
+            "chunk_index": i,
+            "content": content,
+            "content_hash": hashlib.sha256(content.encode()).hexdigest(),
+            "start_char": i * 500,
+            "end_char": i * 500 + len(content),
+            "page_number": i // 10 + 1,
+        })
+    return chunks
+
+
+async def create_document(label: str) -> uuid.UUID:
+    doc_id = uuid.uuid4()
+    async with async_session() as db:
+        db.add(Document(
+            id=doc_id,
+            filename=f"bench-{label}.txt",
+            original_filename=f"bench-{label}.txt",
+            file_type="txt",
+            file_size_bytes=0,
+            file_hash=uuid.uuid4().hex,
+            storage_path="/dev/null",
+            status="processing",
+        ))
+        await db.commit()
+    return doc_id
+
+
+async def drop_document(doc_id: uuid.UUID) -> None:
+    async with async_session() as db:
+        await db.execute(delete(Document).where(Document.id == doc_id))
+        await db.commit()
+
+
+async def orm_insert(doc_id: uuid.UUID, chunks: list[dict], vector_ids: list[str]) -> None:
+    async with async_session() as db:
+        for chunk, vector_id in zip(chunks, vector_ids):
+            db.add(DocumentChunk(
+                document_id=doc_id,
+                chunk_index=chunk["chunk_index"],
+                content=chunk["content"],
+                content_hash=chunk["content_hash"],
+                vector_id=vector_id,
+                start_char=chunk.get("start_char"),
+                end_char=chunk.get("end_char"),
+                page_number=chunk.get("page_number"),
+            ))
+        await db.commit()
+
+
+async def bulk_insert(doc_id: uuid.UUID, chunks: list[dict], vector_ids: list[str]) -> None:
+    async with async_session() as db:
+        await insert_chunks(db, doc_id, chunks, vector_ids)
+        await db.commit()
+
+
+async def measure(label: str, fn, chunks: list[dict], vector_ids: list[str]) -> float:
+    doc_id = await create_document(label)
+    try:
+        start = time.perf_counter()
+        await fn(doc_id, chunks, vector_ids)
+        return time.perf_counter() - start
+    finally:
+        await drop_document(doc_id)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=10000)
+    args = parser.parse_args()
+
+    await init_db()
+    chunks = make_chunks(args.chunks)
+    vector_ids = [str(uuid.uuid4()) for _ in chunks]
+
+    orm_time = await measure("orm", orm_insert, chunks, vector_ids)
+    bulk_time = await measure("bulk", bulk_insert, chunks, vector_ids)
+    await engine.dispose()
+
+    print(f"chunks={args.chunks}")
+    print(f"orm add   {orm_time:8.3f}s  {args.chunks / orm_time:10.0f} rows/s")
+    print(f"bulk      {bulk_time:8.3f}s  {args.chunks / bulk_time:10.0f} rows/s")
+    print(f"speedup   {orm_time / bulk_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
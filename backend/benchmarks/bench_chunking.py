@@ -0,0 +1,196 @@
+"""Micro-benchmarks for chunk offset and page mapping.
+
+Each case runs the previous find()/linear-scan chunkers and the streaming
+iter_chunks used at ingest on the same input, checks the output is identical
+and reports the timings.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_chunking
+"""
+import argparse
+import hashlib
+import random
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.config import get_settings
+from app.services.document import iter_chunks
+
+settings = get_settings()
+
+WORDS = (
+    "order shipping warranty return refund invoice product battery screen "
+    "replacement support account password delivery tracking customer policy"
+).split()
+
+
+def legacy_chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> list[dict]:
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=settings.CHUNK_SEPARATORS,
+        length_function=len,
+    )
+
+    docs = splitter.create_documents([text])
+    chunks = []
+
+    current_pos = 0
+    for doc in docs:
+        chunk_content = doc.page_content.strip()
+        if not chunk_content:
+            continue
+
+        start_char = text.find(chunk_content, current_pos)
+        if start_char == -1:
+            start_char = current_pos
+        end_char = start_char + len(chunk_content)
+        current_pos = max(current_pos, start_char + 1)
+
+        chunks.append({
+            "chunk_index": len(chunks),
+            "content": chunk_content,
+            "content_hash": hashlib.sha256(chunk_content.encode()).hexdigest(),
+            "start_char": start_char,
+            "end_char": end_char,
+        })
+
+    return chunks
+
+
+def legacy_chunk_text_with_pages(pages: list[dict], chunk_size: int, chunk_overlap: int) -> list[dict]:
+    full_text = "\n\n".join(p["content"] for p in pages)
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=settings.CHUNK_SEPARATORS,
+        length_function=len,
+    )
+
+    docs = splitter.create_documents([full_text])
+    chunks = []
+
+    page_offsets = []
+    offset = 0
+    for page in pages:
+        page_offsets.append({
+            "page_number": page["page_number"],
+            "start": offset,
+            "end": offset + len(page["content"]),
+        })
+        offset += len(page["content"]) + 2
+
+    current_pos = 0
+    for doc in docs:
+        chunk_content = doc.page_content.strip()
+        if not chunk_content:
+            continue
+
+        start_char = full_text.find(chunk_content, current_pos)
+        if start_char == -1:
+            start_char = current_pos
+        end_char = start_char + len(chunk_content)
+        current_pos = max(current_pos, start_char + 1)
+
+        page_number = None
+        for po in page_offsets:
+            if po["start"] <= start_char < po["end"]:
+                page_number = po["page_number"]
+                break
+
+        chunks.append({
+            "chunk_index": len(chunks),
+            "content": chunk_content,
+            "content_hash": hashlib.sha256(chunk_content.encode()).hexdigest(),
+            "start_char": start_char,
+            "end_char": end_char,
+            "page_number": page_number,
+        })
+
+    return chunks
+
+
+def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> list[dict]:
+    return list(iter_chunks([{"page_number": None, "content": text}], "", chunk_size, chunk_overlap))
+
+
+def chunk_text_with_pages(pages: list[dict], chunk_size: int, chunk_overlap: int) -> list[dict]:
+    return list(iter_chunks(pages, "\n\n", chunk_size, chunk_overlap))
+
+
+def random_page(rng: random.Random, paragraphs: int) -> str:
+    parts = []
+    for _ in range(paragraphs):
+        sentences = [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize() + "."
+            for _ in range(rng.randint(2, 8))
+        ]
+        parts.append(" ".join(sentences))
+    return "\n\n".join(parts)
+
+
+def make_pages(rng: random.Random, page_count: int) -> list[dict]:
+    pages = []
+    for page_num in range(page_count):
+        if page_num % 50 == 7:
+            content = ""
+        elif page_num % 10 == 3:
+            content = "Section header\n" + "Repeated boilerplate line.\n" * 30
+        else:
+            content = random_page(rng, rng.randint(3, 10))
+        pages.append({"page_number": page_num + 1, "content": content})
+    return pages
+
+
+def timed(fn, *args, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_case(name: str, legacy_fn, new_fn, data, chunk_size: int, chunk_overlap: int, repeat: int) -> None:
+    legacy_time, legacy_result = timed(legacy_fn, data, chunk_size, chunk_overlap, repeat=repeat)
+    new_time, new_result = timed(new_fn, data, chunk_size, chunk_overlap, repeat=repeat)
+    assert legacy_result == new_result, f"{name}: output differs from legacy chunker"
+    print(
+        f"{name:<36} chunks={len(new_result):>6}  legacy={legacy_time * 1000:9.1f}ms  "
+        f"new={new_time * 1000:9.1f}ms  speedup={legacy_time / new_time:6.2f}x"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pages = make_pages(rng, args.pages)
+    text = "\n".join(p["content"] for p in pages)
+    repetitive = "hello world\n\nsecond para " * (len(text) // 25)
+
+    for chunk_size, chunk_overlap in ((500, 50), (settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)):
+        label = f"{chunk_size}/{chunk_overlap}"
+        run_case(f"chunk_text {label}", legacy_chunk_text, chunk_text, text, chunk_size, chunk_overlap, args.repeat)
+        run_case(f"chunk_text repetitive {label}", legacy_chunk_text, chunk_text, repetitive, chunk_size, chunk_overlap, args.repeat)
+        run_case(
+            f"chunk_text_with_pages {label}",
+            legacy_chunk_text_with_pages,
+            chunk_text_with_pages,
+            pages,
+            chunk_size,
+            chunk_overlap,
+            args.repeat,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare serial and process-pool PDF page extraction.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_pdf_extraction --pages 1000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import fitz
+
+from app.services import document
+from app.services.document import close_pdf_executor, iter_pdf_pages
+
+
+def legacy_extract_pages(file_path: str) -> list[dict]:
+    doc = fitz.open(file_path)
+    try:
+        return [
+            {"page_number": page_num + 1, "content": page.get_text()}
+            for page_num, page in enumerate(doc)
+        ]
+    finally:
+        doc.close()
+
+
+def extract_pages(file_path: str) -> list[dict]:
+    return list(iter_pdf_pages(file_path))
+
+
+def build_pdf(path: Path, page_count: int) -> None:
+    doc = fitz.open()
+    line = "The quick brown fox jumps over the lazy dog. " * 2
+    for page_num in range(page_count):
+        page = doc.new_page()
+        text = "\n".join(f"Page {page_num + 1} line {i}: {line}" for i in range(40))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def timed(fn, file_path: str, repeat: int) -> tuple[float, list[dict]]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(file_path)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / "bench.pdf"
+        build_pdf(pdf_path, args.pages)
+
+        # Warm the pool so worker start-up is not charged to the first run.
+        document.get_pdf_executor().submit(int).result()
+
+        legacy_time, legacy_result = timed(legacy_extract_pages, str(pdf_path), args.repeat)
+        new_time, new_result = timed(extract_pages, str(pdf_path), args.repeat)
+        close_pdf_executor()
+
+    assert legacy_result == new_result, "parallel extraction output differs from serial"
+
+    print(f"pages={args.pages} workers={document._pdf_worker_count()}")
+    print(f"legacy   {legacy_time:8.3f}s  {args.pages / legacy_time:10.1f} pages/s")
+    print(f"parallel {new_time:8.3f}s  {args.pages / new_time:10.1f} pages/s")
+    print(f"speedup  {legacy_time / new_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
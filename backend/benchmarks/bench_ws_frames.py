@@ -0,0 +1,107 @@
+"""Micro-benchmark for chat WebSocket token framing.
+
+Encodes the same token stream the way the handler used to (a WebSocketMessage
+per token, dumped and serialized with json) and with the current JSON and
+MessagePack encoders, checks every encoding decodes back to the same tokens
+and reports bytes on the wire and CPU time per token.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_ws_frames
+"""
+import argparse
+import json
+import random
+import time
+
+from app.models.chat import ContextSourceType, SourceInfo, WebSocketMessage
+from app.services.connection import decode_msgpack, encode_json, encode_msgpack, token_frame
+
+WORDS = (
+    "order shipping warranty return refund invoice product battery screen "
+    "replacement support account password delivery tracking customer policy"
+).split()
+
+
+def make_tokens(rng: random.Random, count: int) -> list[str]:
+    # Roughly what providers stream: a word or word piece, usually with its
+    # leading space.
+    tokens = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.3:
+            word = word[:rng.randint(2, len(word))]
+        tokens.append(" " + word if rng.random() < 0.8 else word)
+    return tokens
+
+
+def source_info() -> SourceInfo:
+    return SourceInfo(source_type=ContextSourceType.DOCUMENTS, sources=["returns-policy.pdf"])
+
+
+def legacy_frames(tokens: list[str]) -> list[str]:
+    frames = []
+    for i, token in enumerate(tokens):
+        msg = WebSocketMessage(type="token", content=token)
+        if i == 0:
+            msg.source_info = source_info()
+        frames.append(json.dumps(msg.model_dump(), separators=(",", ":"), ensure_ascii=False))
+    return frames
+
+
+def json_frames(tokens: list[str]) -> list[str]:
+    first = source_info().model_dump()
+    return [encode_json(token_frame(token, first if i == 0 else None)) for i, token in enumerate(tokens)]
+
+
+def msgpack_frames(tokens: list[str]) -> list[bytes]:
+    first = source_info().model_dump()
+    return [encode_msgpack(token_frame(token, first if i == 0 else None)) for i, token in enumerate(tokens)]
+
+
+def frame_size(frame) -> int:
+    return len(frame.encode()) if isinstance(frame, str) else len(frame)
+
+
+def timed(fn, *args, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tokens = make_tokens(random.Random(args.seed), args.tokens)
+    cases = (
+        ("legacy json (pydantic)", legacy_frames, json.loads),
+        ("json", json_frames, json.loads),
+        ("msgpack", msgpack_frames, decode_msgpack),
+    )
+
+    baseline = None
+    for name, encode, decode in cases:
+        seconds, frames = timed(encode, tokens, repeat=args.repeat)
+        decoded = [decode(frame) for frame in frames]
+        assert [f["content"] for f in decoded] == tokens, f"{name}: tokens differ after decoding"
+        assert decoded[0]["source_info"]["sources"] == ["returns-policy.pdf"], f"{name}: source_info lost"
+
+        size = sum(frame_size(frame) for frame in frames)
+        baseline = baseline or (seconds, size)
+        print(
+            f"{name:<24} bytes/token={size / len(tokens):7.1f}  "
+            f"us/token={seconds / len(tokens) * 1e6:6.2f}  "
+            f"bytes={size / baseline[1]:5.2f}x  cpu={seconds / baseline[0]:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Optional
+
+import app.services.chat as chat_module
+from app.services.answer_cache import CachedAnswer
+from app.services.chat import ChatService
+from app.services.latency import TurnTimer
+
+
+class RecordingAnswerCache:
+    enabled = True
+
+    def __init__(self, answer: Optional[CachedAnswer] = None):
+        self.answer = answer
+        self.lookups = 0
+        self.stores = 0
+        self.skips = 0
+
+    async def lookup(self, *args):
+        self.lookups += 1
+        return self.answer
+
+    async def store(self, *args):
+        self.stores += 1
+
+    async def record_skip(self):
+        self.skips += 1
+
+
+class StubEmbedding:
+
+    async def embed(self, text):
+        return [0.1, 0.2]
+
+
+class StubLLM:
+
+    async def resolve_model_config(self, db, model_id):
+        return SimpleNamespace(id="model", model_name="stub", max_tokens=256), None
+
+    async def stream(self, db, messages, model_id):
+        for chunk in ("Hello", " there"):
+            yield chunk
+
+
+class StubPersistenceQueue:
+
+    def __init__(self):
+        self.turns = []
+
+    async def submit(self, turn):
+        self.turns.append(turn)
+
+    def record_timing(self, row):
+        pass
+
+
+def make_service(
+    memory_snippets: list[str],
+    web_results: Optional[list] = None,
+    cached: Optional[CachedAnswer] = None,
+) -> tuple[ChatService, RecordingAnswerCache]:
+    service = ChatService.__new__(ChatService)
+    service.answer_cache = RecordingAnswerCache(cached)
+    service.llm = StubLLM()
+    service.embedding_service = StubEmbedding()
+    service.web_search_enabled = web_results is not None
+    service.relevance_threshold = 0.5
+    service.retrieved = False
+
+    async def search_documents(query, limit=5, query_vector=None):
+        return [], 0.0
+
+    async def get_rag_context(db, hits, limit=5):
+        service.retrieved = True
+        return []
+
+    async def get_memory_context(query, user_id, query_vector=None):
+        return memory_snippets
+
+    async def get_chat_history(db, session_id, limit=20):
+        return "", []
+
+    async def finish_web_search(web_task, web_started, query, rag_hit):
+        return web_results or []
+
+    service._search_documents = search_documents
+    service._get_rag_context = get_rag_context
+    service._get_memory_context = get_memory_context
+    service.get_chat_history = get_chat_history
+    service._finish_web_search = finish_web_search
+    service.web_search = SimpleNamespace(
+        format_results=lambda results: "\n".join(results),
+        get_source_urls=lambda results: ["https://example.com"],
+    )
+    service._build_messages = lambda model, message, session_id, turn: []
+    return service, service.answer_cache
+
+
+def run_turn(service: ChatService, monkeypatch) -> str:
+    queue = StubPersistenceQueue()
+    monkeypatch.setattr(chat_module, "get_persistence_queue", lambda: queue)
+
+    async def consume():
+        stream = service.chat_stream(None, "What is your return policy?", "session", "user", timer=TurnTimer())
+        return "".join([chunk async for chunk, _ in stream])
+
+    return asyncio.run(consume())
+
+
+def test_turn_with_low_score_memories_bypasses_answer_cache(monkeypatch):
+    # Any memory in the prompt makes the answer user-specific, however weakly
+    # it matched the question.
+    service, cache = make_service(["- User: my name is Alice\nAssistant: Hi Alice"])
+
+    assert run_turn(service, monkeypatch) == "Hello there"
+    assert cache.lookups == 0
+    assert cache.stores == 0
+    assert cache.skips == 1
+
+
+def test_turn_without_memories_uses_answer_cache(monkeypatch):
+    service, cache = make_service([])
+
+    assert run_turn(service, monkeypatch) == "Hello there"
+    assert cache.lookups == 1
+    assert cache.stores == 1
+
+
+def test_cache_hit_skips_retrieval_and_generation(monkeypatch):
+    cached = CachedAnswer(answer="Returns are free within 30 days.", source_type="documents")
+    service, cache = make_service([], cached=cached)
+
+    assert run_turn(service, monkeypatch) == cached.answer
+    assert cache.lookups == 1
+    assert cache.stores == 0
+    assert not service.retrieved
+
+
+def test_web_sourced_answer_is_not_stored(monkeypatch):
+    # Web results can change without the corpus version moving.
+    service, cache = make_service([], web_results=["Returns: 30 days"])
+
+    assert run_turn(service, monkeypatch) == "Hello there"
+    assert cache.lookups == 1
+    assert cache.stores == 0
@@ -4,28 +4,52 @@ export const dynamic = 'force-dynamic';
 
 const API_URL = process.env.API_URL || 'http://localhost:8000';
 
+const FORWARDED_REQUEST_HEADERS = ['range', 'if-range', 'if-none-match'];
+const FORWARDED_RESPONSE_HEADERS = [
+  'content-type',
+  'content-disposition',
+  'content-length',
+  'content-range',
+  'accept-ranges',
+  'etag',
+  'last-modified',
+  'cache-control',
+];
+
 export async function GET(
   request: NextRequest,
   { params }: { params: Promise<{ documentId: string }> }
 ) {
   const { documentId } = await params;
-  const response = await fetch(`${API_URL}/api/documents/${documentId}/content`);
 
-  if (!response.ok) {
+  const requestHeaders: HeadersInit = {};
+  for (const name of FORWARDED_REQUEST_HEADERS) {
+    const value = request.headers.get(name);
+    if (value) {
+      requestHeaders[name] = value;
+    }
+  }
+
+  const response = await fetch(
+    `${API_URL}/api/documents/${documentId}/content${request.nextUrl.search}`,
+    { headers: requestHeaders, cache: 'no-store' }
+  );
+
+  if (!response.ok && response.status !== 304) {
     const data = await response.json();
     return NextResponse.json(data, { status: response.status });
   }
 
-  const contentType = response.headers.get('content-type') || 'application/octet-stream';
-  const contentDisposition = response.headers.get('content-disposition');
-  const blob = await response.blob();
-
-  const headers: HeadersInit = {
-    'Content-Type': contentType,
-  };
-  if (contentDisposition) {
-    headers['Content-Disposition'] = contentDisposition;
+  const headers: HeadersInit = {};
+  for (const name of FORWARDED_RESPONSE_HEADERS) {
+    const value = response.headers.get(name);
+    if (value) {
+      headers[name] = value;
+    }
   }
 
-  return new NextResponse(blob, { headers });
+  return new NextResponse(response.status === 304 ? null : response.body, {
+    status: response.status,
+    headers,
+  });
 }
@@ -27,7 +27,7 @@ export function DocumentViewer({ doc, isOpen, onClose }: DocumentViewerProps) {
       setError(null);
 
       try {
-        const response = await fetch(`/api/documents/${doc.id}/content`);
+        const response = await fetch(`/api/documents/${doc.id}/content?v=${doc.file_hash}`);
         if (!response.ok) {
           throw new Error('Failed to load document');
         }
@@ -7,6 +7,7 @@ export interface Document {
   original_filename: string;
   file_type: string;
   file_size_bytes: number;
+  file_hash: string;
   status: DocumentStatus;
   chunks_count: number;
   visibility: DocumentVisibility;